@@ -50,6 +50,10 @@ DEPENDENCIES = {
         'module': 'mutagen',
         'required': True,
     },
+    'lxml': {
+        'module': 'lxml.etree',
+        'required': False,
+    },
 }
 
 CMD_DEPENDENCIES = {
@@ -61,6 +65,10 @@ CMD_DEPENDENCIES = {
         'cmd': video._get_ffmpeg_path,
         'required': False,
     },
+    'Ffprobe': {
+        'cmd': video._get_ffprobe_path,
+        'required': False,
+    },
 }
 
 
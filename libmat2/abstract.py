@@ -23,14 +23,22 @@ class AbstractParser(abc.ABC):
             filename = os.path.join('.', filename)
 
         self.filename = filename
+        self.output_filename = self.get_output_filename(filename)
+        self.lightweight_cleaning = False
+        # Parsers able to clean the file in place do so when this is set,
+        # and point `output_filename` to `filename` afterwards.
+        self.inplace_cleaning = False
+
+    @staticmethod
+    def get_output_filename(filename: str) -> str:
+        """ Return the name of the cleaned version of `filename`. """
         fname, extension = os.path.splitext(filename)
 
         # Special case for tar.gz, tar.bz2, … files
         if fname.endswith('.tar') and len(fname) > 4:
             fname, extension = fname[:-4], '.tar' + extension
 
-        self.output_filename = fname + '.cleaned' + extension
-        self.lightweight_cleaning = False
+        return fname + '.cleaned' + extension
 
     @abc.abstractmethod
     def get_meta(self) -> dict[str, str | dict]:
@@ -39,6 +47,16 @@ class AbstractParser(abc.ABC):
         :raises RuntimeError: Raised if the cleaning process went wrong.
         """
 
+    def has_metadata(self) -> bool:
+        """ Return whether the current file contains metadata that
+        `remove_all` would remove. Parsers are encouraged to override this
+        with something cheaper than `get_meta`, but must err on the side of
+        returning True when they can't tell.
+
+        :raises ValueError: Raised upon an invalid file
+        """
+        return bool(self.get_meta())
+
     @abc.abstractmethod
     def remove_all(self) -> bool:
         """
@@ -46,3 +64,24 @@ class AbstractParser(abc.ABC):
 
         :raises RuntimeError: Raised if the cleaning process went wrong.
         """
+
+    @classmethod
+    def _get_meta_in_memory(cls, data: bytes) -> dict[str, str | dict] | None:
+        """ Return the metadata of `data`, without touching the filesystem,
+        or None if the parser's backend can only work on files.
+
+        :raises ValueError: Raised upon invalid data
+        """
+        # pylint: disable=unused-argument
+        return None
+
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        """ Remove all the metadata of `data`, without touching the filesystem.
+        Parsers whose backend can only work on files return None, and the
+        caller has to fall back to a temporary file.
+
+        :raises ValueError: Raised upon invalid data
+        """
+        # pylint: disable=unused-argument
+        return None
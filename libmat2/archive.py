@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import abc
+import io
 import stat
 import zipfile
 import datetime
@@ -10,7 +11,7 @@ import os
 import logging
 import shutil
 import sys
-from typing import Pattern, Union, Any
+from typing import Iterator, Pattern, Union, Any
 
 from . import abstract, UnknownMemberPolicy, parser_factory
 
@@ -81,6 +82,29 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
         # pylint: disable=unused-argument
         return {}  # pragma: no cover
 
+    def _is_kept(self, member_name: str) -> bool:
+        """ Whether the member has to be kept as-is, via `files_to_keep`."""
+        return any(map(lambda r: r.search(member_name), self.files_to_keep))
+
+    def _is_omitted(self, member_name: str) -> bool:
+        """ Whether the member has to be dropped, via `files_to_omit`,
+        which `files_to_keep` takes precedence over."""
+        if self._is_kept(member_name):
+            return False
+        return any(map(lambda r: r.search(member_name), self.files_to_omit))
+
+    def _is_cleanable_in_memory(self, member_name: str) -> bool:
+        """ This method can be used to clean some members without extracting
+        them, via `_clean_member_data`."""
+        # pylint: disable=unused-argument
+        return False
+
+    def _clean_member_data(self, member_name: str, data: bytes) -> bytes | None:
+        """ Return the cleaned version of the content of a member,
+        or None if something went wrong."""
+        # pylint: disable=unused-argument
+        return None  # pragma: no cover
+
     def _final_checks(self) -> bool:
         """ This method is invoked after the file has been cleaned,
         allowing to run final verifications.
@@ -118,6 +142,22 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
                              full_path: str):
         """Add the file at full_path to the archive, via the given member."""
 
+    @abc.abstractmethod
+    def _get_member_data(self, archive: ArchiveClass, member: ArchiveMember) -> bytes:
+        """Return the content of the given member, for the parsers
+        cleaning some of them in memory."""
+
+    @abc.abstractmethod
+    def _add_bytes_to_archive(self, archive: ArchiveClass, member: ArchiveMember,
+                              data: bytes):
+        """Add data to the archive, via the given member, for the parsers
+        cleaning some of them in memory."""
+
+    @staticmethod
+    @abc.abstractmethod
+    def _get_member_permissions(member: ArchiveMember) -> int:
+        """Get the permissions of the archive member."""
+
     @staticmethod
     def _set_member_permissions(member: ArchiveMember, permissions: int) -> ArchiveMember:
         """Set the permission of the archive member."""
@@ -136,6 +176,29 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
         # pylint: disable=unused-argument
         return member
 
+    def __extract_members(self, zin, temp_folder: str) -> Iterator[tuple[ArchiveMember, str, str]]:
+        """ Extract the members of `zin` in `temp_folder` one by one, and
+        yield them along with their name and their extracted path. """
+        for item in self._get_all_members(zin):
+            member_name = self._get_member_name(item)
+
+            if self._is_dir(item):  # pragma: no cover
+                continue  # don't keep empty folders
+
+            full_path = os.path.join(temp_folder, member_name)
+            if not os.path.abspath(full_path).startswith(temp_folder):
+                logging.error("%s contains a file (%s) pointing outside (%s) of its root.",
+                    self.filename, member_name, full_path)
+                break
+
+            try:
+                zin.extract(member=item, path=temp_folder)
+            except OSError as e:
+                logging.error("Unable to extraxt %s from %s: %s", item, self.filename, e)
+
+            os.chmod(full_path, stat.S_IRUSR)
+            yield item, member_name, full_path
+
     def get_meta(self) -> dict[str, str | dict]:
         meta: dict[str, str | dict] = dict()
 
@@ -143,25 +206,8 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
             temp_folder = tempfile.mkdtemp()
 
             try:
-                for item in self._get_all_members(zin):
+                for item, member_name, full_path in self.__extract_members(zin, temp_folder):
                     local_meta = self._get_member_meta(item)
-                    member_name = self._get_member_name(item)
-
-                    if self._is_dir(item):  # pragma: no cover
-                        continue  # don't keep empty folders
-
-                    full_path = os.path.join(temp_folder, member_name)
-                    if not os.path.abspath(full_path).startswith(temp_folder):
-                        logging.error("%s contains a file (%s) pointing outside (%s) of its root.",
-                            self.filename, member_name, full_path)
-                        break
-
-                    try:
-                        zin.extract(member=item, path=temp_folder)
-                    except OSError as e:
-                        logging.error("Unable to extraxt %s from %s: %s", item, self.filename, e)
-
-                    os.chmod(full_path, stat.S_IRUSR)
 
                     specific_meta = self._specific_get_meta(full_path, member_name)
                     local_meta = {**local_meta, **specific_meta}
@@ -176,6 +222,25 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
                 shutil.rmtree(temp_folder)
         return meta
 
+    def has_metadata(self) -> bool:
+        with self.archive_class(self.filename) as zin:
+            # The members' headers can be checked without extracting anything.
+            for item in self._get_all_members(zin):
+                if self._get_member_meta(item):
+                    return True
+
+            temp_folder = tempfile.mkdtemp()
+            try:
+                for _, member_name, full_path in self.__extract_members(zin, temp_folder):
+                    if self._specific_get_meta(full_path, member_name):
+                        return True
+                    member_parser, _ = parser_factory.get_parser(full_path)  # type: ignore
+                    if member_parser and member_parser.has_metadata():
+                        return True
+            finally:
+                shutil.rmtree(temp_folder)
+        return False
+
     def remove_all(self) -> bool:
         # pylint: disable=too-many-branches
 
@@ -211,6 +276,23 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
                         abort = True
                         break
 
+                    original_compression = self._get_member_compression(item)
+
+                    if self._is_cleanable_in_memory(member_name):
+                        if self._is_omitted(member_name):
+                            continue
+                        data = self._clean_member_data(member_name,
+                                                       self._get_member_data(zin, item))
+                        if data is None:
+                            logging.warning("Something went wrong during deep cleaning of %s in %s",
+                                            member_name, self.filename)
+                            abort = True
+                            continue
+                        zinfo = self.member_class(member_name)  # type: ignore
+                        zinfo = self._set_member_permissions(zinfo, self._get_member_permissions(item))
+                        zinfo = self._set_member_compression(zinfo, original_compression)
+                        self._add_bytes_to_archive(zout, self._clean_member(zinfo), data)
+                        continue
 
                     if (zin is tarfile.TarFile) and sys.version_info < (3, 12):
                         zin.extract(member=item, path=temp_folder, filter='data')
@@ -230,18 +312,16 @@ class ArchiveBasedAbstractParser(abstract.AbstractParser):
 
                     os.chmod(full_path, original_permissions | stat.S_IWUSR | stat.S_IRUSR)
 
-                    original_compression = self._get_member_compression(item)
-
                     if self._specific_cleanup(full_path, member_name) is False:
                         logging.warning("Something went wrong during deep cleaning of %s in %s",
                                         member_name, self.filename)
                         abort = True
                         continue
 
-                    if any(map(lambda r: r.search(member_name), self.files_to_keep)):
+                    if self._is_kept(member_name):
                         # those files aren't supported, but we want to add them anyway
                         pass
-                    elif any(map(lambda r: r.search(member_name), self.files_to_omit)):
+                    elif self._is_omitted(member_name):
                         continue
                     else:  # supported files that we want to first clean, then add
                         member_parser, mtype = parser_factory.get_parser(full_path)  # type: ignore
@@ -381,6 +461,22 @@ class TarParser(ArchiveBasedAbstractParser):
         assert isinstance(archive, tarfile.TarFile)  # please mypy
         archive.add(full_path, member.name, filter=TarParser._clean_member)  # type: ignore
 
+    def _get_member_data(self, archive: ArchiveClass, member: ArchiveMember) -> bytes:
+        assert isinstance(archive, tarfile.TarFile)  # please mypy
+        assert isinstance(member, tarfile.TarInfo)  # please mypy
+        f = archive.extractfile(member)
+        if f is None:  # pragma: no cover
+            return b''  # not a regular file
+        with f:
+            return f.read()
+
+    def _add_bytes_to_archive(self, archive: ArchiveClass, member: ArchiveMember,
+                              data: bytes):
+        assert isinstance(archive, tarfile.TarFile)  # please mypy
+        assert isinstance(member, tarfile.TarInfo)  # please mypy
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+
     @staticmethod
     def _get_all_members(archive: ArchiveClass) -> list[ArchiveMember]:
         assert isinstance(archive, tarfile.TarFile)  # please mypy
@@ -391,6 +487,11 @@ class TarParser(ArchiveBasedAbstractParser):
         assert isinstance(member, tarfile.TarInfo)  # please mypy
         return member.name
 
+    @staticmethod
+    def _get_member_permissions(member: ArchiveMember) -> int:
+        assert isinstance(member, tarfile.TarInfo)  # please mypy
+        return member.mode
+
     @staticmethod
     def _set_member_permissions(member: ArchiveMember, permissions: int) -> ArchiveMember:
         assert isinstance(member, tarfile.TarInfo)  # please mypy
@@ -468,6 +569,17 @@ class ZipParser(ArchiveBasedAbstractParser):
             archive.writestr(member, f.read(),
                              compress_type=member.compress_type)
 
+    def _get_member_data(self, archive: ArchiveClass, member: ArchiveMember) -> bytes:
+        assert isinstance(archive, zipfile.ZipFile)  # please mypy
+        assert isinstance(member, zipfile.ZipInfo)  # please mypy
+        return archive.read(member)
+
+    def _add_bytes_to_archive(self, archive: ArchiveClass, member: ArchiveMember,
+                              data: bytes):
+        assert isinstance(archive, zipfile.ZipFile)  # please mypy
+        assert isinstance(member, zipfile.ZipInfo)  # please mypy
+        archive.writestr(member, data, compress_type=member.compress_type)
+
     @staticmethod
     def _get_all_members(archive: ArchiveClass) -> list[ArchiveMember]:
         assert isinstance(archive, zipfile.ZipFile)  # please mypy
@@ -478,6 +590,11 @@ class ZipParser(ArchiveBasedAbstractParser):
         assert isinstance(member, zipfile.ZipInfo)  # please mypy
         return member.filename
 
+    @staticmethod
+    def _get_member_permissions(member: ArchiveMember) -> int:
+        assert isinstance(member, zipfile.ZipInfo)  # please mypy
+        return member.external_attr >> 16
+
     @staticmethod
     def _get_member_compression(member: ArchiveMember):
         assert isinstance(member, zipfile.ZipInfo)  # please mypy
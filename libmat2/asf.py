@@ -0,0 +1,264 @@
+""" Native handling of ASF (WMV, WMA) files, whose metadata are all living
+in the header object, to avoid remuxing them with ffmpeg. """
+
+from __future__ import annotations
+
+import datetime
+import os
+import struct
+import uuid
+from typing import IO, Iterator
+
+from . import fastcopy
+
+
+def _guid(s: str) -> bytes:
+    return uuid.UUID(s).bytes_le
+
+
+_HEADER = _guid('75B22630-668E-11CF-A6D9-00AA0062CE6C')
+_DATA = _guid('75B22636-668E-11CF-A6D9-00AA0062CE6C')
+_FILE_PROPERTIES = _guid('8CABDCA1-A947-11CF-8EE4-00C00C205365')
+_HEADER_EXTENSION = _guid('5FBF03B5-A92E-11CF-8EE3-00C00C205365')
+_CONTENT_DESCRIPTION = _guid('75B22633-668E-11CF-A6D9-00AA0062CE6C')
+_EXTENDED_CONTENT_DESCRIPTION = _guid('D2D0A440-E307-11D2-97F0-00A0C95EA850')
+_METADATA = _guid('C5F8CBEA-5BAF-4877-8467-AA8C44FA4CCA')
+_METADATA_LIBRARY = _guid('44231C94-9498-49D1-A141-1D134E457054')
+_SIMPLE_INDEX = _guid('33000890-E5B1-11CF-89F4-00A0C90349CB')
+
+# Objects of the header, and of its extension, that are dropped,
+# along with the name under which they are reported when not parsed.
+_DROPPED = {
+    _CONTENT_DESCRIPTION: None,
+    _EXTENDED_CONTENT_DESCRIPTION: None,
+    _METADATA: None,
+    _METADATA_LIBRARY: None,
+    _guid('2211B3FA-BD23-11D2-B4B7-00A0C955FC6E'): 'ContentBranding',
+    _guid('F487CD01-A951-11CF-8EE6-00C00C205365'): 'Marker',
+    _guid('1EFB1A30-0B62-11D0-A39B-00A0C90348F6'): 'ScriptCommand',
+    _guid('1806D474-CADF-4509-A4BA-9AABCB96AAE8'): None,  # Padding
+}
+
+# Top-level objects that might follow the data one.
+_INDEXES = {
+    _SIMPLE_INDEX,
+    _guid('D6E229D3-35DA-11D1-9034-00A0C90349BE'),  # Index
+    _guid('FEB103F8-12AD-4C64-840F-2A1D2F7AD48C'),  # Media Object Index
+    _guid('3CB73FD0-0C4A-4803-953D-EDF7B6228F0C'),  # Timecode Index
+}
+
+_OBJECT_HEADER = struct.Struct('<16sQ')
+
+# Dates are in 100-nanosecond intervals since the beginning of 1601.
+_EPOCH = datetime.datetime(1601, 1, 1)
+
+
+def _iter_objects(data: bytes, start: int, end: int) -> Iterator[tuple[bytes, int, int]]:
+    """ Yield the GUID, the start and the end of the objects
+    contained in data[start:end]. """
+    position = start
+    while position < end:
+        if end - position < _OBJECT_HEADER.size:
+            raise ValueError('Truncated object header')
+        guid, size = _OBJECT_HEADER.unpack_from(data, position)
+        if size < _OBJECT_HEADER.size or position + size > end:
+            raise ValueError('Invalid size for the object %s' % uuid.UUID(bytes_le=guid))
+        yield guid, position, position + size
+        position += size
+
+
+def _iter_header_objects(header: bytes) -> Iterator[tuple[bytes, int, int]]:
+    count, = struct.unpack_from('<I', header, 24)
+    objects = list(_iter_objects(header, 30, len(header)))
+    if len(objects) != count:
+        raise ValueError('Invalid number of header objects')
+    return iter(objects)
+
+
+def _read_header(f: IO[bytes]) -> bytes:
+    f.seek(0)
+    header = f.read(30)
+    if len(header) != 30 or header[:16] != _HEADER:
+        raise ValueError('Not an ASF file')
+    size, = struct.unpack_from('<Q', header, 16)
+    if size < 30:
+        raise ValueError('Invalid size for the header object')
+    header += f.read(size - 30)
+    if len(header) != size:
+        raise ValueError('Truncated header object')
+    return header
+
+
+def _clean_header_extension(data: bytes, start: int, end: int) -> bytes:
+    if end - start < 46:
+        raise ValueError('Truncated header extension object')
+    extensions = b''.join(data[ext_start:ext_end] for guid, ext_start, ext_end
+                          in _iter_objects(data, start + 46, end)
+                          if guid not in _DROPPED)
+    return (_OBJECT_HEADER.pack(_HEADER_EXTENSION, 46 + len(extensions)) +
+            data[start + 24:start + 42] + struct.pack('<I', len(extensions)) +
+            extensions)
+
+
+def clean(input_filename: str, output_filename: str) -> None:
+    """ Write a version of `input_filename` without its metadata
+    to `output_filename`. The data object is copied as-is.
+
+    :raises ValueError: Raised if the file is invalid, or if its
+                        layout isn't supported.
+    """
+    with open(input_filename, 'rb') as fin:
+        header = _read_header(fin)
+
+        objects = list()
+        file_properties = None
+        for guid, start, end in _iter_header_objects(header):
+            if guid in _DROPPED:
+                continue
+            if guid == _HEADER_EXTENSION:
+                objects.append(_clean_header_extension(header, start, end))
+                continue
+            if guid == _FILE_PROPERTIES:
+                if end - start < 104:
+                    raise ValueError('Truncated file properties object')
+                file_properties = len(objects)
+            objects.append(header[start:end])
+        if file_properties is None:
+            raise ValueError('Missing file properties object')
+
+        # The data object is mandatory, and can only be followed by indexes.
+        file_size = fin.seek(0, os.SEEK_END)
+        top_level = list()
+        position = len(header)
+        while position < file_size:
+            fin.seek(position)
+            object_header = fin.read(_OBJECT_HEADER.size)
+            if len(object_header) != _OBJECT_HEADER.size:
+                raise ValueError('Truncated object header')
+            guid, size = _OBJECT_HEADER.unpack(object_header)
+            if guid not in _INDEXES and not (guid == _DATA and not top_level):
+                raise ValueError('Unsupported top-level object')
+            # The data and simple index objects are starting with the file ID
+            if size < 40 or position + size > file_size:
+                raise ValueError('Invalid size for a top-level object')
+            top_level.append((guid, position, size))
+            position += size
+        if not top_level:
+            raise ValueError('Missing data object')
+
+        header_size = 30 + sum(len(o) for o in objects)
+        new_size = header_size + sum(size for _, _, size in top_level)
+
+        # Zero the file ID and the creation date, and update the file size
+        properties = bytearray(objects[file_properties])
+        properties[24:40] = bytes(16)
+        struct.pack_into('<QQ', properties, 40, new_size, 0)
+        objects[file_properties] = bytes(properties)
+
+        try:
+            with open(output_filename, 'wb') as fout:
+                fout.write(_OBJECT_HEADER.pack(_HEADER, header_size))
+                fout.write(struct.pack('<I', len(objects)) + header[28:30])
+                fout.write(b''.join(objects))
+                for guid, start, size in top_level:
+                    if guid in (_DATA, _SIMPLE_INDEX):
+                        fout.write(_OBJECT_HEADER.pack(guid, size) + bytes(16))
+                        fout.flush()
+                        fastcopy.copy_range(fin.fileno(), fout.fileno(), start + 40, size - 40)
+                    else:
+                        fout.flush()
+                        fastcopy.copy_range(fin.fileno(), fout.fileno(), start, size)
+        except OSError:
+            os.remove(output_filename)
+            raise
+
+
+def _decode(data: bytes) -> str:
+    return data.decode('utf-16-le', errors='replace').rstrip('\x00')
+
+
+def _get_value(value_type: int, data: bytes) -> str:
+    if value_type == 0:  # Unicode string
+        return _decode(data)
+    if value_type in (2, 3, 4, 5) and len(data) in (2, 4, 8):  # bool/int
+        return str(int.from_bytes(data, 'little'))
+    if value_type == 6 and len(data) == 16:  # GUID
+        return str(uuid.UUID(bytes_le=data)).upper()
+    return '(Binary data %d bytes)' % len(data)
+
+
+def _get_name(name: str) -> str:
+    """ exiftool doesn't keep the `WM/` prefix. """
+    return name[3:] if name.startswith('WM/') else name
+
+
+def _get_descriptors_meta(data: bytes, start: int, end: int,
+                          meta: dict[str, str | dict]) -> None:
+    """ Extended content description object """
+    count, = struct.unpack_from('<H', data, start + 24)
+    position = start + 26
+    for _ in range(count):
+        name_size, = struct.unpack_from('<H', data, position)
+        name = _decode(data[position + 2:position + 2 + name_size])
+        position += 2 + name_size
+        value_type, value_size = struct.unpack_from('<HH', data, position)
+        value = data[position + 4:position + 4 + value_size]
+        position += 4 + value_size
+        if position > end:
+            raise ValueError('Truncated extended content description object')
+        meta[_get_name(name)] = _get_value(value_type, value)
+
+
+def _get_metadata_meta(data: bytes, start: int, end: int,
+                       meta: dict[str, str | dict]) -> None:
+    """ Metadata and metadata library objects """
+    count, = struct.unpack_from('<H', data, start + 24)
+    position = start + 26
+    for _ in range(count):
+        _, _, name_size, value_type, value_size = struct.unpack_from('<HHHHI', data, position)
+        position += 12
+        name = _decode(data[position:position + name_size])
+        value = data[position + name_size:position + name_size + value_size]
+        position += name_size + value_size
+        if position > end:
+            raise ValueError('Truncated metadata object')
+        meta[_get_name(name)] = _get_value(value_type, value)
+
+
+def get_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Return the metadata of `f`, with the same names as exiftool,
+    by only reading its header object.
+
+    :raises ValueError: Raised if the file is invalid, or if its
+                        layout isn't supported.
+    """
+    meta: dict[str, str | dict] = dict()
+    header = _read_header(f)
+    try:
+        for guid, start, end in _iter_header_objects(header):
+            if guid == _FILE_PROPERTIES:
+                file_id, _, creation_date = struct.unpack_from('<16sQQ', header, start + 24)
+                if file_id.strip(b'\x00'):
+                    meta['FileID'] = str(uuid.UUID(bytes_le=file_id)).upper()
+                if creation_date:
+                    date = _EPOCH + datetime.timedelta(microseconds=creation_date // 10)
+                    meta['CreationDate'] = date.strftime('%Y:%m:%d %H:%M:%SZ')
+            elif guid == _CONTENT_DESCRIPTION:
+                sizes = struct.unpack_from('<5H', header, start + 24)
+                position = start + 34
+                for name, size in zip(('Title', 'Author', 'Copyright', 'Description', 'Rating'), sizes):
+                    value = _decode(header[position:position + size])
+                    if value:
+                        meta[name] = value
+                    position += size
+            elif guid == _EXTENDED_CONTENT_DESCRIPTION:
+                _get_descriptors_meta(header, start, end, meta)
+            elif guid == _HEADER_EXTENSION:
+                for ext_guid, ext_start, ext_end in _iter_objects(header, start + 46, end):
+                    if ext_guid in (_METADATA, _METADATA_LIBRARY):
+                        _get_metadata_meta(header, ext_start, ext_end, meta)
+            elif _DROPPED.get(guid):
+                meta[_DROPPED[guid]] = '(Binary data %d bytes)' % (end - start - 24)
+    except struct.error:
+        raise ValueError('Truncated header object')
+    return meta
@@ -2,61 +2,335 @@ from __future__ import annotations
 
 __lazy_modules__ = ['mutagen']
 
+import collections
+import copy
+import hashlib
+import io
+import logging
 import mimetypes
 import os
-import shutil
+import struct
 import tempfile
+from typing import IO
 
 import mutagen
-import mutagen.apev2
+import mutagen.flac
 import mutagen.id3
 
-from . import abstract, parser_factory, video
+from . import abstract, fastcopy, parser_factory, riff, video
+
+
+# magic, original size of the file, size of its head, offset of its tail
+_JOURNAL_HEADER = struct.Struct('>8sQQQ')
+_JOURNAL_MAGIC = b'MAT2JRNL'
+_JOURNAL_SUFFIX = '.mat2-journal'
+
+
+def _get_appended_tags_offset(f: IO[bytes]) -> int:
+    """ Return the offset of the ID3v1 and APEv2 tags glued at the end of `f`,
+    or its size if there aren't any. """
+    end = f.seek(0, os.SEEK_END)
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+    if end >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b'APETAGEX':
+            size, flags = struct.unpack('<I4xI', footer[12:24])
+            if flags & (1 << 31):  # the tag also has a header
+                size += 32
+            if size <= end:
+                end -= size
+    return end
+
+
+def _has_appended_tags(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return _get_appended_tags_offset(f) != f.seek(0, os.SEEK_END)
+
+
+def _fsync_directory(path: str) -> None:
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_journal(filename: str, size: int, head: bytes, tail_offset: int, tail: bytes) -> None:
+    """ Durably save the parts of `filename` that are going to be modified,
+    so that they can be restored if mat2 is interrupted while modifying it. """
+    content = _JOURNAL_HEADER.pack(_JOURNAL_MAGIC, size, len(head), tail_offset) + head + tail
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content + hashlib.sha256(content).digest())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, filename + _JOURNAL_SUFFIX)
+    except OSError:
+        os.remove(temp_path)
+        raise
+    _fsync_directory(filename)
+
+
+def _remove_journal(filename: str) -> None:
+    os.remove(filename + _JOURNAL_SUFFIX)
+    _fsync_directory(filename)
+
+
+def _restore_journal(filename: str) -> bool:
+    """ Restore `filename` from the journal left by an interrupted
+    in-place cleaning, and return False if there isn't any.
+
+    :raises ValueError: Raised if the journal is corrupted
+    """
+    try:
+        with open(filename + _JOURNAL_SUFFIX, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return False
+
+    content, checksum = content[:-32], content[-32:]
+    if len(content) < _JOURNAL_HEADER.size or hashlib.sha256(content).digest() != checksum:
+        raise ValueError("The journal of %s is corrupted" % filename)
+    magic, size, head_size, tail_offset = _JOURNAL_HEADER.unpack_from(content)
+    if magic != _JOURNAL_MAGIC:
+        raise ValueError("The journal of %s is corrupted" % filename)
+    head = content[_JOURNAL_HEADER.size:_JOURNAL_HEADER.size + head_size]
+    tail = content[_JOURNAL_HEADER.size + head_size:]
+
+    logging.warning("Restoring %s from the journal of an interrupted cleaning", filename)
+    with open(filename, 'r+b') as f:
+        f.write(head)
+        f.truncate(size)
+        f.seek(tail_offset)
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+    _remove_journal(filename)
+    return True
+
+
+# The tracks of an album usually all embed the same cover art.
+_picture_meta_cache: collections.OrderedDict[tuple[str, bytes], dict[str, str | dict]] = \
+        collections.OrderedDict()
+_PICTURE_META_CACHE_SIZE = 32
+
+
+def _get_picture_meta(mimetype: str, data: bytes) -> dict[str, str | dict]:
+    """ Return the metadata of an embedded picture, analysed from memory.
+
+    :raises ValueError: Raised upon unsupported or invalid pictures
+    """
+    key = (mimetype, hashlib.sha256(data).digest())
+    meta = _picture_meta_cache.get(key)
+    if meta is None:
+        meta = parser_factory.get_meta_bytes(data, mimetype)
+        if len(_picture_meta_cache) >= _PICTURE_META_CACHE_SIZE:
+            _picture_meta_cache.popitem(last=False)
+        _picture_meta_cache[key] = meta
+    else:
+        _picture_meta_cache.move_to_end(key)
+    return copy.deepcopy(meta)
+
+
+def _keep_padding(info: mutagen.PaddingInfo) -> int:
+    """ Make mutagen fill the space freed by the removed tags with padding,
+    so that the audio data doesn't have to be moved. """
+    return info.padding
+
+
+def _rewind(filething) -> None:
+    """ mutagen expects file objects to be positioned at their beginning. """
+    if not isinstance(filething, str):
+        filething.seek(0)
 
 
 class MutagenParser(abstract.AbstractParser):
     def __init__(self, filename):
         super().__init__(filename)
-        try:
-            if mutagen.File(self.filename) is None:
+        self.__mutagen_file = None
+        # A file left half-written by an interrupted in-place cleaning can't
+        # be parsed until its journal is restored, which only the in-place
+        # `remove_all` does: merely reading its metadata mustn't modify it.
+        if not os.path.exists(self.filename + _JOURNAL_SUFFIX):
+            self._get_mutagen_file()
+
+    def _get_mutagen_file(self) -> mutagen.FileType:
+        """ Parsing the file is what's expensive, so it's only done once,
+        unless the file has been modified since.
+
+        :raises ValueError: Raised if the file is invalid.
+        """
+        if self.__mutagen_file is None:
+            try:
+                f = mutagen.File(self.filename)
+            except mutagen.MutagenError as e:
+                raise ValueError(e)
+            if f is None:
                 raise ValueError
-        except mutagen.MutagenError as e:
-            raise ValueError(e)
+            self.__mutagen_file = f
+        return self.__mutagen_file
 
     def get_meta(self) -> dict[str, str | dict]:
-        f = mutagen.File(self.filename)
+        f = self._get_mutagen_file()
         if f.tags:
             return {k: ', '.join(map(str, v)) for k, v in f.tags.items()}
         return {}
 
-    def _remove_appended_tags(self) -> None:
+    def has_metadata(self) -> bool:
+        return bool(self._get_mutagen_file().tags) or _has_appended_tags(self.filename)
+
+    @staticmethod
+    def _remove_appended_tags(fileobj: IO[bytes]) -> None:
         """ mutagen.File() only binds the container's primary tag, so an APEv2
         or ID3 block glued to the file is left untouched by delete(). """
-        for module in (mutagen.apev2, mutagen.id3):
+        offset = _get_appended_tags_offset(fileobj)
+        if offset != fileobj.seek(0, os.SEEK_END):
+            fileobj.truncate(offset)
+
+    @staticmethod
+    def _delete_tags(f: mutagen.FileType, filething) -> None:
+        """ Remove the primary tag of `f` from `filething`, which is either
+        a filename or a file object. """
+        _rewind(filething)
+        f.delete(filething)
+        _rewind(filething)
+        f.save(filething)
+
+    @staticmethod
+    def _get_head_size(f: IO[bytes]) -> int | None:
+        """ Return the size of the part of `f` holding its tags, or None if
+        they can't be cleaned in place. """
+        # pylint: disable=unused-argument
+        return None
+
+    @staticmethod
+    def _clean_head(head: bytes) -> bytes | None:
+        """ Return `head` without its tags, padded to its original size,
+        or None if they can't be cleaned in place. """
+        # pylint: disable=unused-argument
+        return None  # pragma: no cover
+
+    def __remove_all_inplace(self) -> bool:
+        """ Strip the tags directly in the original file, by rewriting its head
+        and truncating its appended tags, and return False if its layout
+        doesn't allow this. Only those two parts are journaled beforehand. """
+        with open(self.filename, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            tail_offset = _get_appended_tags_offset(f)
+            f.seek(0)
+            head_size = self._get_head_size(f)
+            if head_size is None or head_size > tail_offset:
+                return False
+            f.seek(0)
+            head = f.read(head_size)
             try:
-                module.delete(self.output_filename)
-            except mutagen.MutagenError as e:
-                raise ValueError(e)
+                new_head = self._clean_head(head) if head else head
+            except mutagen.MutagenError:
+                return False
+            if new_head is None or len(new_head) != len(head):  # the audio data would have to move
+                return False
+            if new_head == head and tail_offset == size:
+                return True  # already clean
+            f.seek(tail_offset)
+            tail = f.read()
+
+            _write_journal(self.filename, size, head, tail_offset, tail)
+            f.seek(0)
+            f.write(new_head)
+            f.truncate(tail_offset)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.__mutagen_file = None
+        try:
+            self._get_mutagen_file()
+        except ValueError:  # pragma: no cover
+            _restore_journal(self.filename)
+            self.__mutagen_file = None
+            return False
+        _remove_journal(self.filename)
+        return True
 
     def remove_all(self) -> bool:
-        shutil.copy(self.filename, self.output_filename)
+        if self.inplace_cleaning:
+            try:
+                # the file is only restored when it's about to be modified anyway
+                if _restore_journal(self.filename):
+                    self.__mutagen_file = None
+                if self.__remove_all_inplace():
+                    self.output_filename = self.filename
+                    return True
+            except OSError as e:
+                if os.path.exists(self.filename + _JOURNAL_SUFFIX):
+                    _restore_journal(self.filename)
+                raise RuntimeError(e)
+
         try:
-            f = mutagen.File(self.output_filename)
-            f.delete()
-            f.save()
-            self._remove_appended_tags()
+            fastcopy.copy_file(self.filename, self.output_filename)
+            # The copy being identical to the original, the latter's parsed
+            # version can be used to clean it. It won't be accurate anymore
+            # once the cleaning is done though.
+            f, self.__mutagen_file = self._get_mutagen_file(), None
+            with open(self.output_filename, 'r+b') as fileobj:
+                self._delete_tags(f, fileobj)
+                self._remove_appended_tags(fileobj)
         except (mutagen.MutagenError, ValueError) as e:
             os.remove(self.output_filename)
             raise ValueError(e)
         return True
 
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        fileobj = io.BytesIO(data)
+        try:
+            f = mutagen.File(fileobj)
+            if f is None:
+                raise ValueError
+            cls._delete_tags(f, fileobj)
+            cls._remove_appended_tags(fileobj)
+        except mutagen.MutagenError as e:
+            raise ValueError(e)
+        return fileobj.getvalue()
+
 
 class MP3Parser(MutagenParser):
     mimetypes = {'audio/mpeg', }
 
+    @staticmethod
+    def _get_head_size(f: IO[bytes]) -> int | None:
+        header = f.read(10)
+        if len(header) != 10 or header[:3] != b'ID3':
+            return 0
+        if header[5] & 0x10:  # mutagen doesn't write footers
+            return None
+        size = 0
+        for byte in header[6:10]:  # synchsafe integer
+            size = (size << 7) | (byte & 0x7f)
+        return 10 + size
+
+    @staticmethod
+    def _clean_head(head: bytes) -> bytes:
+        fileobj = io.BytesIO(head)
+        tags = mutagen.id3.ID3(fileobj)
+        tags.clear()
+        _rewind(fileobj)
+        tags.save(fileobj, v1=0, padding=_keep_padding)
+        return fileobj.getvalue()
+
+    @staticmethod
+    def _delete_tags(f: mutagen.FileType, filething) -> None:
+        # This removes both the ID3v2 and ID3v1 tags
+        _rewind(filething)
+        f.delete(filething)
+
     def get_meta(self) -> dict[str, str | dict]:
         metadata: dict[str, str | dict] = dict()
-        meta = mutagen.File(self.filename).tags
+        meta = self._get_mutagen_file().tags
         if not meta:
             return metadata
         for key in meta:
@@ -76,38 +350,54 @@ class OGGParser(MutagenParser):
 class FLACParser(MutagenParser):
     mimetypes = {'audio/flac', 'audio/x-flac'}
 
-    def remove_all(self) -> bool:
-        shutil.copy(self.filename, self.output_filename)
-        try:
-            f = mutagen.File(self.output_filename)
-            f.clear_pictures()
-            f.delete()
-            f.save(deleteid3=True)
-            self._remove_appended_tags()
-        except (mutagen.MutagenError, ValueError) as e:
-            os.remove(self.output_filename)
-            raise ValueError(e)
-        return True
+    @staticmethod
+    def _delete_tags(f: mutagen.FileType, filething) -> None:
+        f.clear_pictures()
+        _rewind(filething)
+        f.delete(filething)
+        _rewind(filething)
+        f.save(filething, deleteid3=True)
+
+    @staticmethod
+    def _get_head_size(f: IO[bytes]) -> int | None:
+        if f.read(4) != b'fLaC':  # for example, a leading ID3 tag
+            return None
+        offset = 4
+        while True:
+            header = f.read(4)
+            if len(header) != 4:
+                return None
+            offset += 4 + int.from_bytes(header[1:], 'big')
+            if header[0] & 0x80:  # last metadata block
+                return offset
+            f.seek(offset)
+
+    @staticmethod
+    def _clean_head(head: bytes) -> bytes:
+        fileobj = io.BytesIO(head)
+        f = mutagen.flac.FLAC(fileobj)
+        f.clear_pictures()
+        if f.tags is not None:
+            f.metadata_blocks.remove(f.tags)
+            f.tags = None
+        _rewind(fileobj)
+        f.save(fileobj, padding=_keep_padding)
+        return fileobj.getvalue()
+
+    def has_metadata(self) -> bool:
+        if self._get_mutagen_file().pictures:
+            return True
+        return super().has_metadata()
 
     def get_meta(self) -> dict[str, str | dict]:
         meta = super().get_meta()
-        for num, picture in enumerate(mutagen.File(self.filename).pictures):
+        for num, picture in enumerate(self._get_mutagen_file().pictures):
             name = picture.desc if picture.desc else 'Cover %d' % num
             extension = mimetypes.guess_extension(picture.mime)
             if extension is None: #  pragma: no cover
                 meta[name] = 'harmful data'
                 continue
-
-            _, fname = tempfile.mkstemp()
-            fname = fname + extension
-            with open(fname, 'wb') as f:
-                f.write(picture.data)
-            p, _ = parser_factory.get_parser(fname)  # type: ignore
-            if p is None:
-                raise ValueError
-            # Mypy chokes on ternaries :/
-            meta[name] = p.get_meta() if p else 'harmful data'  # type: ignore
-            os.remove(fname)
+            meta[name] = _get_picture_meta(picture.mime, picture.data)
         return meta
 
 
@@ -121,6 +411,14 @@ class WAVParser(video.AbstractFFmpegParser):
                       'MIMEType', 'NumChannels', 'SampleRate', 'SourceFile',
                      }
 
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        return riff.get_wav_meta(f)
+
+    def _remove_all_natively(self) -> bool:
+        riff.clean_wav(self.filename, self.output_filename)
+        return True
+
 
 class AIFFParser(video.AbstractFFmpegParser):
     mimetypes = {'audio/aiff', 'audio/x-aiff'}
@@ -132,3 +430,11 @@ class AIFFParser(video.AbstractFFmpegParser):
                       'MIMEType', 'NumChannels', 'SampleRate', 'SourceFile',
                       'NumSampleFrames', 'SampleSize',
                      }
+
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        return riff.get_aiff_meta(f)
+
+    def _remove_all_natively(self) -> bool:
+        riff.clean_aiff(self.filename, self.output_filename)
+        return True
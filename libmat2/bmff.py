@@ -0,0 +1,375 @@
+""" A minimal ISO base media file format (ISO/IEC 14496-12) cleaner,
+to strip the metadata of MP4 files without remuxing them. """
+
+from __future__ import annotations
+
+import datetime
+import os
+import struct
+from typing import Callable, IO, Iterator
+
+from . import fastcopy
+
+# Boxes only holding other boxes, that are cleaned recursively.
+_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+
+# Boxes holding metadata, or padding that might contain leftovers of them.
+_DROPPED = {b'udta', b'meta', b'uuid', b'free', b'skip', b'wide'}
+
+# Top-level boxes that are kept, every other one being either dropped,
+# or unsupported.
+_KEPT_TOP_LEVEL = {b'ftyp', b'moov', b'mdat'}
+
+# Fragmented and compressed files aren't supported.
+_UNSUPPORTED = {b'moof', b'mfra', b'mvex', b'sidx', b'styp', b'cmov'}
+
+_UNDETERMINED_LANGUAGE = b'\x55\xc4'  # 'und', as packed ISO-639-2/T
+
+# Names of the metadata, as exiftool reports them.
+_TAGS = {
+    b'\xa9too': 'Encoder', b'\xa9nam': 'Title', b'\xa9ART': 'Artist',
+    b'\xa9alb': 'Album', b'\xa9day': 'ContentCreateDate', b'\xa9cmt': 'Comment',
+    b'\xa9gen': 'Genre', b'\xa9wrt': 'Composer', b'\xa9xyz': 'GPSCoordinates',
+    b'\xa9swr': 'SoftwareVersion', b'\xa9enc': 'EncodedBy', b'\xa9mak': 'Make',
+    b'\xa9mod': 'Model', b'\xa9des': 'Description', b'\xa9inf': 'Information',
+    b'\xa9cpy': 'Copyright', b'\xa9aut': 'Author', b'\xa9fmt': 'Format',
+    b'\xa9req': 'Requirements', b'\xa9dir': 'Director', b'\xa9prd': 'Producer',
+    b'desc': 'Description', b'cprt': 'Copyright', b'aART': 'AlbumArtist',
+    b'covr': 'CoverArt', b'name': 'Name', b'XMP_': 'XMP', b'Xtra': 'Xtra',
+}
+_DATES = {b'mvhd': 'CreateDate', b'tkhd': 'TrackCreateDate', b'mdhd': 'MediaCreateDate'}
+
+# Minimal sizes of the version 0 and 1 of the full boxes.
+_MIN_SIZES = {b'mvhd': (100, 112), b'tkhd': (84, 96), b'mdhd': (24, 36)}
+
+# Dates are in seconds since the beginning of 1904.
+_EPOCH = datetime.datetime(1904, 1, 1)
+
+Relocator = Callable[[int], int]
+
+
+def clean(input_filename: str, output_filename: str) -> None:
+    """ Write a version of `input_filename` without its metadata
+    to `output_filename`. The media data are copied as-is.
+
+    :raises ValueError: Raised if the file is invalid, or if its
+                        layout isn't supported.
+    """
+    with open(input_filename, 'rb') as fin:
+        boxes = list(_iter_top_level_boxes(fin))
+        moovs = [box for box in boxes if box[0] == b'moov']
+        if len(moovs) != 1 or boxes[0][0] != b'ftyp':
+            raise ValueError('Unsupported layout')
+        _, moov_start, moov_header, moov_end = moovs[0]
+        fin.seek(moov_start)
+        moov = fin.read(moov_end - moov_start)
+        if len(moov) != moov_end - moov_start:
+            raise ValueError('Truncated moov box')
+
+        # The size of the cleaned moov doesn't depend on the chunk offsets,
+        # so it can be computed before knowing where the media data will be.
+        moov_size = len(_clean_box(moov, 0, b'moov', moov_header, len(moov), lambda x: x))
+
+        kept = list()
+        mdats = list()  # (old start, old end, new start) of their data
+        position = 0
+        for box_type, start, header_size, end in boxes:
+            if box_type in _DROPPED:
+                continue
+            if box_type not in _KEPT_TOP_LEVEL:
+                raise ValueError('Unsupported top-level box %r' % box_type)
+            if box_type == b'mdat':
+                mdats.append((start + header_size, end, position + header_size))
+            kept.append((box_type, start, end))
+            position += moov_size if box_type == b'moov' else end - start
+
+        def relocate(offset: int) -> int:
+            for old_start, old_end, new_start in mdats:
+                if old_start <= offset < old_end:
+                    return offset - old_start + new_start
+            raise ValueError('Chunk offset outside of the media data')
+
+        moov = _clean_box(moov, 0, b'moov', moov_header, len(moov), relocate)
+        assert len(moov) == moov_size
+
+        try:
+            with open(output_filename, 'wb') as fout:
+                for box_type, start, end in kept:
+                    if box_type == b'moov':
+                        fout.write(moov)
+                    else:
+                        fout.flush()
+                        fastcopy.copy_range(fin.fileno(), fout.fileno(), start, end - start)
+        except (OSError, ValueError):
+            os.remove(output_filename)
+            raise
+
+
+def get_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Return the metadata of `f`, with the same names as exiftool,
+    without reading the media data.
+
+    :raises ValueError: Raised if the file is invalid, or if its
+                        layout isn't supported.
+    """
+    meta: dict[str, str | dict] = dict()
+    for box_type, start, header_size, end in _iter_top_level_boxes(f):
+        if box_type in {b'moov', b'udta', b'meta'}:
+            f.seek(start)
+            data = f.read(end - start)
+            if len(data) != end - start:
+                raise ValueError('Truncated %r box' % box_type)
+            _get_box_meta(data, box_type, header_size, len(data), meta)
+        elif box_type == b'uuid':
+            meta['UUID'] = '(Binary data %d bytes)' % (end - start - header_size)
+    return meta
+
+
+def _decode(data: bytes) -> str:
+    data = data.rstrip(b'\x00')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def _get_name(box_type: bytes) -> str:
+    return _TAGS.get(box_type, box_type.decode('latin-1'))
+
+
+def _get_box_meta(data: bytes, box_type: bytes, start: int, end: int,
+                  meta: dict[str, str | dict]) -> None:
+    """ Add the metadata of the box of type `box_type`,
+    whose body is data[start:end], to `meta`. """
+    body = data[start:end]
+    if box_type in _CONTAINERS:
+        for child_type, child_start, child_header_size, child_end in _iter_boxes(data, start, end):
+            _get_box_meta(data, child_type, child_start + child_header_size, child_end, meta)
+    elif box_type in _DATES:
+        version = _get_version(body, _MIN_SIZES[box_type])
+        dates = struct.unpack_from('>II' if version == 0 else '>QQ', body, 4)
+        names = (_DATES[box_type], _DATES[box_type].replace('Create', 'Modify'))
+        for name, date in zip(names, dates):
+            if date:
+                date = _EPOCH + datetime.timedelta(seconds=date)
+                meta[name] = date.strftime('%Y:%m:%d %H:%M:%S')
+        language = 20 if version == 0 else 32
+        if box_type == b'mdhd' and body[language:language + 2] != _UNDETERMINED_LANGUAGE:
+            code, = struct.unpack_from('>H', body, language)
+            meta['MediaLanguageCode'] = ''.join(chr(((code >> shift) & 0x1f) + 0x60)
+                                                for shift in (10, 5, 0))
+    elif box_type == b'hdlr':
+        if len(body) < 24:
+            raise ValueError('Truncated hdlr box')
+        if body[12:16].strip(b'\x00'):
+            meta['HandlerVendorID'] = _decode(body[12:16])
+        # The name is either a C string, or a Pascal one for QuickTime files.
+        name = body[24:]
+        if name and name[0] == len(name) - 1:
+            name = name[1:]
+        if name.strip(b'\x00'):
+            meta['HandlerDescription'] = _decode(name)
+    elif box_type == b'udta':
+        for child_type, child_start, child_header_size, child_end in _iter_boxes(data, start, end):
+            child_body = data[child_start + child_header_size:child_end]
+            if child_type == b'meta':
+                _get_box_meta(data, child_type, child_start + child_header_size, child_end, meta)
+            elif child_type.startswith(b'\xa9') and len(child_body) >= 4:
+                # QuickTime strings: 16-bit size, 16-bit language, then the text
+                size, = struct.unpack('>H', child_body[:2])
+                meta[_get_name(child_type)] = _decode(child_body[4:4 + size])
+            elif child_type == b'name':
+                meta[_get_name(child_type)] = _decode(child_body)
+            else:
+                meta[_get_name(child_type)] = '(Binary data %d bytes)' % len(child_body)
+    elif box_type == b'meta':
+        # QuickTime's meta boxes aren't full boxes, unlike ISO ones.
+        if body[4:8] != b'hdlr':
+            start += 4
+        keys: dict[int, str] = dict()
+        for child_type, child_start, child_header_size, child_end in _iter_boxes(data, start, end):
+            if child_type == b'keys':
+                keys = _get_keys(data[child_start + child_header_size:child_end])
+            elif child_type == b'ilst':
+                _get_ilst_meta(data, child_start + child_header_size, child_end, keys, meta)
+    elif box_type == b'uuid':
+        meta['UUID'] = '(Binary data %d bytes)' % len(body)
+
+
+def _get_keys(body: bytes) -> dict[int, str]:
+    """ Return the names of the items of the ilst box, by index. """
+    keys = dict()
+    if len(body) < 8:
+        raise ValueError('Truncated keys box')
+    for index, (_, start, _, end) in enumerate(_iter_boxes(body, 8, len(body)), start=1):
+        keys[index] = _decode(body[start + 8:end])
+    return keys
+
+
+def _get_ilst_meta(data: bytes, start: int, end: int, keys: dict[int, str],
+                   meta: dict[str, str | dict]) -> None:
+    for item_type, item_start, item_header_size, item_end in _iter_boxes(data, start, end):
+        index, = struct.unpack('>I', item_type)
+        name = keys[index] if index in keys else _get_name(item_type)
+        values = list()
+        for child_type, child_start, child_header_size, child_end in _iter_boxes(data, item_start + item_header_size, item_end):
+            if child_type != b'data':
+                continue
+            if child_end - child_start - child_header_size < 8:
+                raise ValueError('Truncated data box')
+            value = data[child_start + child_header_size + 8:child_end]
+            well_known_type, = struct.unpack_from('>I', data, child_start + child_header_size)
+            if well_known_type == 1:  # UTF-8
+                values.append(_decode(value))
+            else:
+                values.append('(Binary data %d bytes)' % len(value))
+        meta[name] = ', '.join(values)
+
+
+def _parse_header(header: bytes) -> tuple[int, bytes, int]:
+    """ Return the size, the type and the size of the header of a box. """
+    size, box_type = struct.unpack('>I4s', header[:8])
+    if size == 1:
+        if len(header) < 16:
+            raise ValueError('Truncated box header')
+        return struct.unpack('>Q', header[8:16])[0], box_type, 16
+    return size, box_type, 8
+
+
+def _iter_top_level_boxes(f: IO[bytes]) -> Iterator[tuple[bytes, int, int, int]]:
+    """ Yield the type, the start, the size of the header,
+    and the end of the top-level boxes of `f`. """
+    file_size = f.seek(0, os.SEEK_END)
+    position = 0
+    while position < file_size:
+        f.seek(position)
+        header = f.read(16)
+        if len(header) < 8:
+            raise ValueError('Truncated box header')
+        size, box_type, header_size = _parse_header(header)
+        if size == 0:  # the box extends to the end of the file
+            size = file_size - position
+        if box_type in _UNSUPPORTED:
+            raise ValueError('Unsupported box %r' % box_type)
+        if size < header_size or position + size > file_size:
+            raise ValueError('Invalid size for the box %r' % box_type)
+        yield box_type, position, header_size, position + size
+        position += size
+
+
+def _iter_boxes(data: bytes, start: int, end: int) -> Iterator[tuple[bytes, int, int, int]]:
+    """ Yield the type, the start, the size of the header,
+    and the end of the boxes contained in data[start:end]. """
+    position = start
+    while position < end:
+        if end - position < 8:
+            raise ValueError('Truncated box header')
+        size, box_type, header_size = _parse_header(data[position:position + 16])
+        if box_type in _UNSUPPORTED:
+            raise ValueError('Unsupported box %r' % box_type)
+        if size < header_size or position + size > end:
+            raise ValueError('Invalid size for the box %r' % box_type)
+        yield box_type, position, header_size, position + size
+        position += size
+
+
+def _make_box(box_type: bytes, body: bytes) -> bytes:
+    if len(body) + 8 > 0xffffffff:  # pragma: no cover
+        return struct.pack('>I4sQ', 1, box_type, len(body) + 16) + body
+    return struct.pack('>I4s', len(body) + 8, box_type) + body
+
+
+def _clean_box(data: bytes, start: int, box_type: bytes, header_size: int,
+               end: int, relocate: Relocator) -> bytes:
+    body = data[start + header_size:end]
+    if box_type in _CONTAINERS:
+        cleaned = bytearray()
+        for child_type, child_start, child_header_size, child_end in _iter_boxes(data, start + header_size, end):
+            if child_type in _DROPPED or child_type.startswith(b'\xa9'):
+                continue
+            cleaned += _clean_box(data, child_start, child_type, child_header_size,
+                                  child_end, relocate)
+        body = bytes(cleaned)
+    elif box_type in _CLEANERS:
+        body = _CLEANERS[box_type](body, relocate)
+    return _make_box(box_type, body)
+
+
+def _get_version(body: bytes, min_sizes: tuple[int, int]) -> int:
+    if not body:
+        raise ValueError('Empty full box')
+    version = body[0]
+    if version > 1 or len(body) < min_sizes[version]:
+        raise ValueError('Unsupported full box')
+    return version
+
+
+def _clean_mvhd(body: bytes, _: Relocator) -> bytes:
+    version = _get_version(body, _MIN_SIZES[b'mvhd'])
+    cleaned = bytearray(body)
+    dates_size = 8 if version == 0 else 16
+    cleaned[4:4 + dates_size] = bytes(dates_size)  # creation/modification times
+    rate = 20 if version == 0 else 32
+    cleaned[rate:rate + 4] = b'\x00\x01\x00\x00'  # preferred rate: 1.0
+    cleaned[rate + 4:rate + 6] = b'\x01\x00'  # preferred volume: 1.0
+    # preview time/duration, poster time, selection time/duration, current time
+    cleaned[rate + 52:rate + 76] = bytes(24)
+    return bytes(cleaned)
+
+
+def _clean_tkhd(body: bytes, _: Relocator) -> bytes:
+    version = _get_version(body, _MIN_SIZES[b'tkhd'])
+    dates_size = 8 if version == 0 else 16
+    return body[:4] + bytes(dates_size) + body[4 + dates_size:]
+
+
+def _clean_mdhd(body: bytes, _: Relocator) -> bytes:
+    version = _get_version(body, _MIN_SIZES[b'mdhd'])
+    cleaned = bytearray(body)
+    dates_size = 8 if version == 0 else 16
+    cleaned[4:4 + dates_size] = bytes(dates_size)
+    language = 20 if version == 0 else 32
+    cleaned[language:language + 2] = _UNDETERMINED_LANGUAGE
+    return bytes(cleaned)
+
+
+def _clean_hdlr(body: bytes, _: Relocator) -> bytes:
+    """ Keep the handler type, but not the vendor or the name,
+    as they are often identifying the software that wrote the file. """
+    if len(body) < 24:
+        raise ValueError('Truncated hdlr box')
+    return body[:12] + bytes(12) + b'\x00'
+
+
+def _clean_vmhd(body: bytes, _: Relocator) -> bytes:
+    if len(body) < 12:
+        raise ValueError('Truncated vmhd box')
+    return body[:6] + bytes(6) + body[12:]  # opcolor
+
+
+def _clean_chunk_offsets(body: bytes, relocate: Relocator, entry_format: str) -> bytes:
+    if len(body) < 8:
+        raise ValueError('Truncated chunk offset box')
+    count, = struct.unpack('>I', body[4:8])
+    entry = struct.Struct('>' + entry_format)
+    if len(body) != 8 + count * entry.size:
+        raise ValueError('Invalid chunk offset box')
+    cleaned = bytearray(body)
+    for position in range(8, len(body), entry.size):
+        offset = relocate(entry.unpack_from(body, position)[0])
+        try:
+            entry.pack_into(cleaned, position, offset)
+        except struct.error:
+            raise ValueError('Chunk offset too large for a stco box')
+    return bytes(cleaned)
+
+
+_CLEANERS: dict[bytes, Callable[[bytes, Relocator], bytes]] = {
+    b'mvhd': _clean_mvhd,
+    b'tkhd': _clean_tkhd,
+    b'mdhd': _clean_mdhd,
+    b'hdlr': _clean_hdlr,
+    b'vmhd': _clean_vmhd,
+    b'stco': lambda body, relocate: _clean_chunk_offsets(body, relocate, 'I'),
+    b'co64': lambda body, relocate: _clean_chunk_offsets(body, relocate, 'Q'),
+}
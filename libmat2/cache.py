@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any
+
+from . import UnknownMemberPolicy, fastcopy
+
+
+class ResultCache:
+    """ An on-disk cache of cleaned files and of their metadata, keyed by
+    the content of the processed file, so that files that were already
+    processed don't have to go through their parser again.
+
+    Entries are written in a temporary file that is then renamed over the
+    final one, so that several processes can safely share the same cache,
+    and the least recently used ones are evicted once the cache grows
+    larger than `max_size` bytes.
+    """
+    # Leftovers of a writer that was killed mid-way can be removed
+    # once they are this old, in seconds.
+    _stale_temp_age = 3600
+
+    def __init__(self, directory: str, version: str,
+                 max_size: int = 512 * 1024 * 1024) -> None:
+        """
+        :raises OSError: Raised if the cache directory can't be created
+        """
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_key(self, filename: str, parser_class: type,
+                lightweight: bool, policy: UnknownMemberPolicy) -> str:
+        """ Return the cache key of `filename`: its hash, along with
+        everything that can change the way it's processed. """
+        with open(filename, 'rb') as f:
+            content_hash = hashlib.file_digest(f, 'sha256').hexdigest()
+        parameters = '\0'.join((self.version,
+                                parser_class.__module__ + '.' + parser_class.__qualname__,
+                                str(lightweight), policy.value, content_hash))
+        return hashlib.sha256(parameters.encode('utf-8')).hexdigest()
+
+    def get_cleaned(self, key: str, output_filename: str) -> bool:
+        """ Write the cached cleaned version of the file to `output_filename`,
+        and return False if there isn't any. """
+        path = self.__get_path(key, '.cleaned')
+        try:
+            with open(path, 'rb') as fin, open(output_filename, 'wb') as fout:
+                fastcopy.copy_fileobj(fin, fout)
+        except FileNotFoundError:
+            return False
+        self.__touch(path)
+        return True
+
+    def put_cleaned(self, key: str, output_filename: str) -> None:
+        """ Store `output_filename` as the cleaned version of the file. """
+        def write(f):
+            with open(output_filename, 'rb') as fin:
+                fastcopy.copy_fileobj(fin, f)
+        self.__store(self.__get_path(key, '.cleaned'), write)
+
+    def get_meta(self, key: str) -> dict[str, Any] | None:
+        """ Return the cached metadata of the file, or None if there aren't any. """
+        path = self.__get_path(key, '.meta')
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f, object_hook=_decode_bytes)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:  # pragma: no cover
+            logging.warning("Ignoring the corrupted cache entry %s: %s", path, e)
+            return None
+        self.__touch(path)
+        return meta
+
+    def put_meta(self, key: str, meta: dict[str, Any]) -> None:
+        """ Store `meta` as the metadata of the file. """
+        content = json.dumps(_encode_bytes(meta), default=str).encode('utf-8')
+        self.__store(self.__get_path(key, '.meta'), lambda f: f.write(content))
+
+    def __get_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    @staticmethod
+    def __touch(path: str) -> None:
+        """ The modification time of an entry is its last use,
+        which is what the eviction is based on. """
+        try:
+            os.utime(path)
+        except OSError:  # pragma: no cover
+            pass  # evicted by an other process in the meantime
+
+    def __store(self, path: str, write) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            if os.stat(temp_path).st_size > self.max_size:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, path)
+        except OSError as e:  # pragma: no cover
+            logging.warning("Unable to store %s in the cache: %s", path, e)
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            return
+        self.__evict()
+
+    def __evict(self) -> None:
+        """ Remove the least recently used entries until the cache
+        fits in `self.max_size` again. """
+        entries = list()
+        total_size = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:  # pragma: no cover
+                continue  # removed by an other process
+            if entry.name.startswith('.'):  # a temporary file
+                if now - st.st_mtime > self._stale_temp_age:  # pragma: no cover
+                    _remove_if_exists(entry.path)
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total_size += st.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            _remove_if_exists(path)
+            total_size -= size
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:  # pragma: no cover
+        pass  # an other process was faster
+
+
+def _encode_bytes(o: Any) -> Any:
+    """ Some parsers, like the torrent one, are returning bytes as metadata,
+    even as dictionary keys, which json can't represent natively. """
+    if isinstance(o, bytes):
+        return {'__bytes__': base64.b64encode(o).decode('ascii')}
+    if isinstance(o, dict):
+        if all(isinstance(k, str) for k in o):
+            return {k: _encode_bytes(v) for k, v in o.items()}
+        return {'__items__': [[_encode_bytes(k), _encode_bytes(v)] for k, v in o.items()]}
+    if isinstance(o, list):
+        return [_encode_bytes(v) for v in o]
+    return o
+
+
+def _decode_bytes(d: dict[str, Any]) -> Any:
+    if list(d.keys()) == ['__bytes__']:
+        return base64.b64decode(d['__bytes__'])
+    if list(d.keys()) == ['__items__']:
+        return {k: v for k, v in d['__items__']}
+    return d
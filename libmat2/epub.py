@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import io
 import logging
 import re
 import zipfile
 import xml.etree.ElementTree as ET  # type: ignore
-from typing import Any
+from typing import Any, Callable
 
-from . import archive, office
+from . import archive, office, parser_factory, web
 
 
 class EPUBParser(archive.ZipParser):
@@ -39,6 +40,10 @@ class EPUBParser(archive.ZipParser):
                 if member_name.endswith('META-INF/encryption.xml'):
                     raise ValueError('the file contains encrypted fonts')
 
+    def has_metadata(self) -> bool:
+        # The unique identifier of the book isn't reported by get_meta
+        return True
+
     def _specific_get_meta(self, full_path, file_path) -> dict[str, Any]:
         if not file_path.endswith('.opf'):
             return {}
@@ -51,52 +56,76 @@ class EPUBParser(archive.ZipParser):
             except (TypeError, UnicodeDecodeError):
                 return {file_path: 'harmful content', }
 
-    def _specific_cleanup(self, full_path: str, member_name: str = '') -> bool:
-        if full_path.endswith(('hmh.opf', 'content.opf')):
-            return self.__handle_contentopf(full_path)
-        elif full_path.endswith('OEBPS/toc.ncx'):
-            return self.__handle_tocncx(full_path)
-        elif re.search('/OPS/[^/]+.xml$', full_path):
-            return self.__handle_ops_xml(full_path)
-        return True
-
-    def __handle_ops_xml(self, full_path: str) -> bool:
+    def __get_handler(self, member_name: str) -> Callable[[bytes], bytes | None] | None:
+        if member_name.endswith(('hmh.opf', 'content.opf')):
+            return self.__handle_contentopf
+        elif member_name.endswith('OEBPS/toc.ncx'):
+            return self.__handle_tocncx
+        elif re.search('(^|/)OPS/[^/]+.xml$', member_name):
+            return self.__handle_ops_xml
+        return None
+
+    def _is_cleanable_in_memory(self, member_name: str) -> bool:
+        # Chapters can be numerous, so they, along with the files that need
+        # a specific cleanup, are cleaned straight from the archive.
+        if self.__get_handler(member_name) is not None:
+            return True
+        parser_class, _ = parser_factory.get_parser_class(member_name)
+        return parser_class in (web.HTMLParser, web.DTBNCXParser, web.CSSParser)
+
+    def _clean_member_data(self, member_name: str, data: bytes) -> bytes | None:
+        handler = self.__get_handler(member_name)
+        if handler is not None:
+            cleaned = handler(data)
+            if cleaned is None:
+                logging.error("Unable to parse %s in %s.", member_name, self.filename)
+                return None
+            data = cleaned
+
+        if self._is_kept(member_name):
+            return data
+        _, mtype = parser_factory.get_parser_class(member_name)
+        return parser_factory.clean_bytes(data, mtype,  # type: ignore
+                                          self.lightweight_cleaning,
+                                          self.unknown_member_policy)
+
+    @staticmethod
+    def __write_xml(tree: ET.ElementTree, namespace: dict[str, str],
+                    short_empty_elements: bool = True) -> bytes:
+        output = io.BytesIO()
+        office._write_xml(tree, output, namespace, short_empty_elements)
+        return output.getvalue()
+
+    def __handle_ops_xml(self, data: bytes) -> bytes | None:
         try:
-            tree, namespace = office._parse_xml(full_path)
+            tree, namespace = office._parse_xml_data(data)
         except ET.ParseError:  # pragma: nocover
-            logging.error("Unable to parse %s in %s.", full_path, self.filename)
-            return False
+            return None
 
         for item in tree.iterfind('.//', namespace):  # pragma: nocover
             if item.tag.strip().lower().endswith('head'):
                 item.clear()
                 break
-        tree.write(full_path, xml_declaration=True, encoding='utf-8',
-                   short_empty_elements=False)
-        return True
+        return self.__write_xml(tree, namespace, short_empty_elements=False)
 
-    def __handle_tocncx(self, full_path: str) -> bool:
+    def __handle_tocncx(self, data: bytes) -> bytes | None:
         try:
-            tree, namespace = office._parse_xml(full_path)
+            tree, namespace = office._parse_xml_data(data)
         except ET.ParseError:  # pragma: nocover
-            logging.error("Unable to parse %s in %s.", full_path, self.filename)
-            return False
+            return None
 
         for item in tree.iterfind('.//', namespace):  # pragma: nocover
             if item.tag.strip().lower().endswith('head'):
                 item.clear()
-                ET.SubElement(item, 'meta', attrib={'name': '', 'content': ''})
+                item.append(item.makeelement('meta', {'name': '', 'content': ''}))
                 break
-        tree.write(full_path, xml_declaration=True, encoding='utf-8',
-                   short_empty_elements=False)
-        return True
+        return self.__write_xml(tree, namespace, short_empty_elements=False)
 
-    def __handle_contentopf(self, full_path: str) -> bool:
+    def __handle_contentopf(self, data: bytes) -> bytes | None:
         try:
-            tree, namespace = office._parse_xml(full_path)
+            tree, namespace = office._parse_xml_data(data)
         except ET.ParseError:
-            logging.error("Unable to parse %s in %s.", full_path, self.filename)
-            return False
+            return None
 
         root = tree.getroot()
         unique_identifier = root.attrib.get('unique-identifier', 'id') or 'id'
@@ -106,18 +135,17 @@ class EPUBParser(archive.ZipParser):
             if item.tag.strip().lower().endswith('metadata'):
                 item.clear()
 
-                identifier = ET.Element(self.metadata_namespace + 'identifier')
+                identifier = item.makeelement(self.metadata_namespace + 'identifier', {})
                 identifier.text = self.sanitized_identifier
                 identifier.set('id', unique_identifier)
                 item.append(identifier)
 
-                language = ET.Element(self.metadata_namespace + 'language')
+                language = item.makeelement(self.metadata_namespace + 'language', {})
                 language.text = 'und'
                 item.append(language)
 
-                title = ET.Element(self.metadata_namespace + 'title')
+                title = item.makeelement(self.metadata_namespace + 'title', {})
                 title.text = 'Untitled'
                 item.append(title)
                 break  # there is only a single <metadata> block
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+        return self.__write_xml(tree, namespace)
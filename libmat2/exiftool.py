@@ -24,8 +24,22 @@ class ExiftoolParser(abstract.AbstractParser):
                                  check=True, stdout=subprocess.PIPE).stdout
         except subprocess.CalledProcessError as e:  # pragma: no cover
             raise ValueError(e)
-        meta = json.loads(out.decode('utf-8'))[0]
-        for key in self.meta_allowlist:
+        return self._filter_meta(json.loads(out.decode('utf-8'))[0])
+
+    @classmethod
+    def _get_meta_in_memory(cls, data: bytes) -> dict[str, str | dict] | None:
+        try:
+            out = subprocess.run([_get_exiftool_path(), '-json', '-'],
+                                 input=data, check=True,
+                                 stdout=subprocess.PIPE).stdout
+        except subprocess.CalledProcessError as e:  # pragma: no cover
+            raise ValueError(e)
+        return cls._filter_meta(json.loads(out.decode('utf-8'))[0])
+
+    @classmethod
+    def _filter_meta(cls, meta: dict[str, str | dict]) -> dict[str, str | dict]:
+        """ Remove the harmless metadata from the ones found by exiftool. """
+        for key in cls.meta_allowlist:
             meta.pop(key, None)
         return meta
 
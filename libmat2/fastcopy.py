@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+from typing import IO
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+# Errors meaning that a given copy method isn't supported
+# for this pair of files, rather than an actual failure.
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EBADF, errno.ETXTBSY, errno.EPERM}
+
+_BUFFER_SIZE = 1024 * 1024
+
+
+def copy_file(src: str, dst: str) -> None:
+    """ Copy the content and the permission bits of `src` to `dst`,
+    like `shutil.copy`, but sharing the underlying data on filesystems
+    supporting reflinks (btrfs, xfs, …), and without going through
+    userspace on the other ones whenever possible.
+
+    :raises OSError: Raised if the copy failed
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copy_fileobj(fsrc, fdst)
+    shutil.copymode(src, dst)
+
+
+def copy_fileobj(fsrc: IO[bytes], fdst: IO[bytes]) -> None:
+    """ Copy the whole content of `fsrc` to `fdst`, which must both be
+    backed by actual files, and be freshly opened.
+
+    :raises OSError: Raised if the copy failed
+    """
+    if not _reflink(fsrc.fileno(), fdst.fileno()):
+        copy_range(fsrc.fileno(), fdst.fileno(), 0, os.fstat(fsrc.fileno()).st_size)
+
+
+def _reflink(fd_src: int, fd_dst: int) -> bool:
+    if fcntl is None:  # pragma: no cover
+        return False
+    try:
+        fcntl.ioctl(fd_dst, _FICLONE, fd_src)
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED and e.errno != errno.ENOTTY:  # pragma: no cover
+            raise
+        return False
+    return True
+
+
+def copy_range(fd_src: int, fd_dst: int, offset: int, length: int) -> None:
+    """ Copy `length` bytes of `fd_src`, starting at `offset`,
+    to the current position of `fd_dst`.
+
+    :raises OSError: Raised if the copy failed, or if `fd_src`
+                     is shorter than expected.
+    """
+    end = offset + length
+    start = os.lseek(fd_dst, 0, os.SEEK_CUR) - offset
+    for method in (_copy_file_range, _sendfile, _buffered_copy):
+        try:
+            offset = method(fd_src, fd_dst, offset, end)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or method is _buffered_copy:
+                raise
+            # try the next method, starting where this one stopped
+            offset = os.lseek(fd_dst, 0, os.SEEK_CUR) - start
+            continue
+        if offset != end:
+            raise OSError(errno.EIO, 'Unexpected end of file')
+        return
+
+
+def _copy_file_range(fd_src: int, fd_dst: int, offset: int, end: int) -> int:
+    if not hasattr(os, 'copy_file_range'):  # pragma: no cover
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    while offset < end:
+        copied = os.copy_file_range(fd_src, fd_dst, end - offset, offset_src=offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+
+def _sendfile(fd_src: int, fd_dst: int, offset: int, end: int) -> int:
+    while offset < end:
+        copied = os.sendfile(fd_dst, fd_src, offset, min(end - offset, 0x7ffff000))
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+
+def _buffered_copy(fd_src: int, fd_dst: int, offset: int, end: int) -> int:
+    while offset < end:
+        data = os.pread(fd_src, min(end - offset, _BUFFER_SIZE), offset)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd_dst, view):]
+        offset += len(data)
+    return offset
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
-import shutil
-from . import abstract
+from . import abstract, fastcopy
 
 
 class HarmlessParser(abstract.AbstractParser):
@@ -11,6 +10,13 @@ class HarmlessParser(abstract.AbstractParser):
     def get_meta(self) -> dict[str, str | dict]:
         return dict()
 
+    def has_metadata(self) -> bool:
+        return False
+
     def remove_all(self) -> bool:
-        shutil.copy(self.filename, self.output_filename)
+        fastcopy.copy_file(self.filename, self.output_filename)
         return True
+
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        return data
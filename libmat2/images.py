@@ -1,7 +1,7 @@
 from __future__ import annotations
 
+import io
 import os
-from typing import Any
 
 import cairo
 
@@ -10,7 +10,7 @@ gi.require_version('GdkPixbuf', '2.0')
 gi.require_version('Rsvg', '2.0')
 from gi.repository import GdkPixbuf, GLib, Rsvg
 
-from . import exiftool, abstract
+from . import exiftool, abstract, netpbm
 
 class SVGParser(exiftool.ExiftoolParser):
     mimetypes = {'image/svg+xml', }
@@ -46,8 +46,9 @@ class SVGParser(exiftool.ExiftoolParser):
         surface.finish()
         return True
 
-    def get_meta(self) -> dict[str, str | dict]:
-        meta = super().get_meta()
+    @classmethod
+    def _filter_meta(cls, meta: dict[str, str | dict]) -> dict[str, str | dict]:
+        meta = super()._filter_meta(meta)
 
         # The namespace is mandatory, but only the …/2000/svg is valid.
         ns = 'http://www.w3.org/2000/svg'
@@ -82,6 +83,19 @@ class PNGParser(exiftool.ExiftoolParser):
         surface.write_to_png(self.output_filename)
         return True
 
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        if lightweight:
+            return None  # exiftool needs an actual file
+        output = io.BytesIO()
+        try:
+            surface = cairo.ImageSurface.create_from_png(io.BytesIO(data))
+            surface.write_to_png(output)
+        except Exception as e:  # pragma: no cover
+            # Cairo is returning some weird exceptions :/
+            raise ValueError(e)
+        return output.getvalue()
+
 
 class GIFParser(exiftool.ExiftoolParser):
     mimetypes = {'image/gif'}
@@ -175,26 +189,22 @@ class TiffParser(GdkPixbufAbstractParser):
 
 
 class PPMParser(abstract.AbstractParser):
-    mimetypes = {'image/x-portable-pixmap'}
+    mimetypes = {'image/x-portable-pixmap', 'image/x-portable-graymap',
+                 'image/x-portable-bitmap', 'image/x-portable-anymap',
+                 'image/x-portable-arbitrarymap'}
 
     def get_meta(self) -> dict[str, str | dict]:
-        meta: dict[str, str | dict[Any, Any]] = dict()
-        with open(self.filename) as f:
-            for idx, line in enumerate(f):
-                if line.lstrip().startswith('#'):
-                    meta[str(idx)] = line.lstrip().rstrip()
-        return meta
+        with open(self.filename, 'rb') as f:
+            return netpbm.get_meta(f)
 
     def remove_all(self) -> bool:
-        with open(self.filename, 'rb') as fin:
-            data = fin.read()
-        if data.startswith(b'P3'):
-            data = b''.join(line for line in data.splitlines(keepends=True)
-                            if not line.lstrip().startswith(b'#'))
-        with open(self.output_filename, 'wb') as fout:
-            fout.write(data)
+        netpbm.clean(self.filename, self.output_filename)
         return True
 
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        return netpbm.clean_bytes(data)
+
 
 class HEICParser(exiftool.ExiftoolParser):
     mimetypes = {'image/heic'}
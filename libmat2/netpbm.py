@@ -0,0 +1,156 @@
+""" Native handling of the netpbm formats (PBM, PGM, PPM, PNM and PAM),
+whose only metadata are comments: in the plain formats, they are removed
+from the whole file, while in the binary ones, they can only live in the
+header, and the raster is copied as-is. """
+
+from __future__ import annotations
+
+import io
+import os
+import re
+from typing import IO
+
+from . import fastcopy
+
+# Number of whitespace-separated fields in the header, including the magic
+_PLAIN = {b'P1': 3, b'P2': 4, b'P3': 4}
+_BINARY = {b'P4': 3, b'P5': 4, b'P6': 4}
+_PAM = b'P7'
+
+_HEADER_TOKEN = re.compile(rb'\s+|#[^\n]*|[^\s#]+')
+_READ_SIZE = 4096
+
+
+def _decode(comment: bytes) -> str:
+    return comment.strip().decode('utf-8', errors='replace')
+
+
+def _read_binary_header(f: IO[bytes], nb_fields: int, meta: dict[str, str | dict]) -> bytes:
+    """ Return the header of `f` without its comments, which are put in
+    `meta`, and leave `f` positioned at the beginning of the raster. """
+    header = bytearray()
+    data = f.read(_READ_SIZE)
+    base, pos, line, fields = 0, 0, 0, 0
+    while True:
+        match = _HEADER_TOKEN.match(data, pos)
+        if match is None or match.end() == len(data):  # maybe truncated
+            more = f.read(_READ_SIZE)
+            if more:
+                data = data[pos:] + more
+                base, pos = base + pos, 0
+                continue
+            if match is None:
+                raise ValueError('Truncated header')
+
+        token = match.group()
+        pos = match.end()
+        if token[0] == ord('#'):
+            meta[str(line)] = _decode(token)
+            # Lines only containing a comment are removed altogether.
+            line_start = header.rfind(b'\n') + 1
+            if not header[line_start:].strip() and data[pos:pos + 1] == b'\n':
+                del header[line_start:]
+                pos += 1
+                line += 1
+        elif token.isspace():
+            header += token
+            line += token.count(b'\n')
+        else:
+            header += token
+            fields += 1
+            if fields == nb_fields:
+                # The last field is followed by a single whitespace.
+                if not data[pos:pos + 1].isspace():
+                    raise ValueError('Invalid header')
+                header += data[pos:pos + 1]
+                f.seek(base + pos + 1)
+                return bytes(header)
+
+
+def _read_pam_header(f: IO[bytes], meta: dict[str, str | dict]) -> bytes:
+    header = bytearray()
+    for idx, line in enumerate(iter(f.readline, b'')):
+        if line.lstrip().startswith(b'#'):
+            meta[str(idx)] = _decode(line)
+            continue
+        header += line
+        if line.strip() == b'ENDHDR':
+            return bytes(header)
+    raise ValueError('Truncated header')
+
+
+def _read_header(f: IO[bytes], meta: dict[str, str | dict]) -> bytes | None:
+    """ Return the header of `f` without its comments, and leave `f`
+    positioned at the beginning of its raster, or return None and
+    leave it at the beginning of the file for the plain formats.
+
+    :raises ValueError: Raised if the file is invalid.
+    """
+    magic = f.read(2)
+    f.seek(0)
+    if magic in _PLAIN:
+        return None
+    elif magic in _BINARY:
+        return _read_binary_header(f, _BINARY[magic], meta)
+    elif magic == _PAM:
+        return _read_pam_header(f, meta)
+    raise ValueError('Not a netpbm file')
+
+
+def _clean_plain(fin: IO[bytes], fout: IO[bytes] | None,
+                 meta: dict[str, str | dict]) -> None:
+    """ Comments can't be mistaken for pixels in the plain formats,
+    so they are removed from the whole file, line by line. """
+    for idx, line in enumerate(fin):
+        comment = line.find(b'#')
+        if comment != -1:
+            meta[str(idx)] = _decode(line[comment:])
+            if not line[:comment].strip():
+                continue
+            line = line[:comment].rstrip(b' \t') + line[len(line.rstrip(b'\r\n')):]
+        if fout is not None:
+            fout.write(line)
+
+
+def clean(input_filename: str, output_filename: str) -> None:
+    """ Write a version of `input_filename` without its comments
+    to `output_filename`.
+
+    :raises ValueError: Raised if the file is invalid.
+    """
+    with open(input_filename, 'rb') as fin:
+        header = _read_header(fin, dict())
+        with open(output_filename, 'wb') as fout:
+            if header is None:
+                _clean_plain(fin, fout, dict())
+                return
+            fout.write(header)
+            fout.flush()
+            offset = fin.tell()
+            fastcopy.copy_range(fin.fileno(), fout.fileno(), offset,
+                                os.fstat(fin.fileno()).st_size - offset)
+
+
+def clean_bytes(data: bytes) -> bytes:
+    """ Return `data` without its comments.
+
+    :raises ValueError: Raised if the data are invalid.
+    """
+    fin = io.BytesIO(data)
+    header = _read_header(fin, dict())
+    if header is None:
+        fout = io.BytesIO()
+        _clean_plain(fin, fout, dict())
+        return fout.getvalue()
+    return header + data[fin.tell():]
+
+
+def get_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Return the comments of `f`, indexed by their line number.
+
+    :raises ValueError: Raised if the file is invalid.
+    """
+    meta: dict[str, str | dict] = dict()
+    if _read_header(f, meta) is None:
+        _clean_plain(f, None, meta)
+    return meta
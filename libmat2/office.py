@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import io
 import random
 import uuid
 import logging
@@ -7,28 +8,220 @@ import os
 import posixpath
 import re
 import zipfile
-from typing import Any
+from typing import IO, Any, Iterable
 
 import xml.etree.ElementTree as ET  # type: ignore
 
 from .archive import ZipParser
 
+try:
+    from lxml import etree as lxml_etree  # type: ignore
+except ImportError:  # pragma: no cover
+    lxml_etree = None
+else:
+    # Older versions are resolving external entities by default.
+    if lxml_etree.LXML_VERSION < (5, 0):  # pragma: no cover
+        lxml_etree = None
+
 # pylint: disable=line-too-long
 
 
-def _parse_xml(full_path: str) -> tuple[ET.ElementTree, dict[str, str]]:
-    """ This function parses XML, with namespace support. """
+def _parse_xml(source: str | IO[bytes]) -> tuple[ET.ElementTree, dict[str, str]]:
+    """ This function parses XML, with namespace support, in a single pass.
+    The returned namespaces are to be passed to `_write_xml`.
+
+    lxml is used when it's available, since its elements know their parent,
+    and can be queried with compiled XPath expressions; ElementTree is used
+    otherwise. Like ElementTree, comments and processing instructions are
+    dropped, and both raise ET.ParseError on invalid documents.
+    """
+    if lxml_etree is None:
+        root, namespace_map = _read_events(ET.iterparse(source, ('start-ns', 'start')))
+        return ET.ElementTree(root), namespace_map
+
+    # lxml gives the root once the parsing is done, so only
+    # the namespaces have to go through Python.
+    events = lxml_etree.iterparse(source, ('start-ns', ),
+                                  remove_comments=True, remove_pis=True,
+                                  resolve_entities='internal', no_network=True)
+    try:
+        _, namespace_map = _read_events(events)
+    except lxml_etree.XMLSyntaxError as e:
+        raise ET.ParseError(str(e)) from e
+    # Entities that lxml doesn't resolve would be kept in the tree as nodes
+    # without a str tag, which ElementTree never produces.
+    for entity in events.root.iter(lxml_etree.Entity):  # pragma: no cover
+        raise ET.ParseError('Unresolved entity %s' % entity.text)
+    return lxml_etree.ElementTree(events.root), namespace_map
+
+
+def _read_events(events) -> tuple[Any, dict[str, str]]:
+    root = None
     namespace_map = dict()
-    for _, (key, value) in ET.iterparse(full_path, ("start-ns", )):
+    for event, value in events:
+        if event == 'start':
+            if root is None:
+                root = value
+            continue
+        key, uri = value
         # The ns[0-9]+ namespaces are reserved for internal usage, so
         # we have to use an other nomenclature.
-        if re.match('^ns[0-9]+$', key, re.IGNORECASE):  # pragma: no cover
+        if re.match('^ns[0-9]+$', key, re.IGNORECASE):
             key = 'mat' + key[2:]
+        namespace_map[key] = uri
+    return root, namespace_map
+
+
+def _parse_xml_data(data: bytes) -> tuple[ET.ElementTree, dict[str, str]]:
+    """ Like `_parse_xml`, but on bytes. """
+    return _parse_xml(io.BytesIO(data))
+
+
+def _is_lxml_tree(tree: ET.ElementTree) -> bool:
+    return not isinstance(tree, ET.ElementTree)
+
+
+def _prefix_names(root: ET.Element, namespace_map: dict[str, str]) -> ET.Element:
+    """ Return a copy of `root` where the `{uri}name` of the namespaces of
+    `namespace_map` are replaced by their `prefix:name`, since ElementTree
+    only has a process-wide registry of prefixes.
+    """
+    prefixes: dict[str, str] = dict()
+    for prefix, uri in namespace_map.items():
+        # This is what ET.register_namespace does
+        for k, v in list(prefixes.items()):
+            if k == uri or v == prefix:
+                del prefixes[k]
+        prefixes[uri] = prefix
+
+    def rename(name: str, is_attribute: bool) -> str:
+        if name[:1] != '{':
+            return name
+        uri, local = name[1:].split('}', 1)
+        prefix = prefixes.get(uri)
+        if prefix is None or (is_attribute and not prefix):
+            # Unprefixed attributes aren't in the default namespace,
+            # so ElementTree has to come up with a prefix for them.
+            return name
+        return prefix + ':' + local if prefix else local
+
+    def copy(element: ET.Element) -> ET.Element:
+        tag = element.tag
+        if isinstance(tag, str):
+            tag = rename(tag, False)
+        attrib = {rename(k, True): v for k, v in element.attrib.items()}
+        new = ET.Element(tag, attrib)
+        new.text, new.tail = element.text, element.tail
+        new.extend(copy(child) for child in element)
+        return new
+
+    new_root = copy(root)
+    declarations = {('xmlns:' + prefix if prefix else 'xmlns'): uri
+                    for uri, prefix in prefixes.items()}
+    new_root.attrib = {**declarations, **new_root.attrib}
+    return new_root
+
+
+def _write_xml(tree: ET.ElementTree, target: str | IO[bytes],
+               namespace_map: dict[str, str], short_empty_elements: bool = True) -> None:
+    """ Write `tree` to `target`, using the prefixes of `namespace_map`. """
+    if _is_lxml_tree(tree):
+        # lxml keeps track of the prefixes of the document by itself,
+        # and writes elements with an empty text as <tag></tag>.
+        if not short_empty_elements:
+            for element in tree.iter():
+                if element.text is None and not len(element):
+                    element.text = ''
+        tree.write(target, xml_declaration=True, encoding='utf-8')
+        return
+
+    root = _prefix_names(tree.getroot(), namespace_map)
+    ET.ElementTree(root).write(target, xml_declaration=True, encoding='utf-8',
+                               short_empty_elements=short_empty_elements)
+
+
+class _ParentIndex:
+    """ Removes and unwraps elements of a tree in bulk.
+
+    ElementTree elements know neither their parent nor their position, so
+    removing them one by one means looking up their parent in a map of the
+    whole tree, then their position among its children, which is quadratic
+    for paragraphs with thousands of tracked runs. Instead, the operations
+    are recorded, then applied by rebuilding the children of every parent
+    involved once.
+    """
+    __REMOVE, __REMOVE_KEEPING_TAIL, __UNWRAP = range(3)
+
+    def __init__(self, tree: ET.ElementTree):
+        self.__tree = tree
+        # Only built when needed, and never for lxml, whose elements
+        # know their parent.
+        self.__parents: dict[ET.Element, ET.Element] | None = None
+        self.__operations: dict[ET.Element, int] = dict()
+        self.__parents_involved: dict[ET.Element, None] = dict()  # ordered set
+
+    def parent(self, element: ET.Element) -> ET.Element | None:
+        if _is_lxml_tree(self.__tree):
+            return element.getparent()  # type: ignore
+        if self.__parents is None:
+            self.__parents = {c: p for p in self.__tree.iter() for c in p}
+        return self.__parents.get(element)
+
+    def __record(self, element: ET.Element, operation: int) -> None:
+        parent = self.parent(element)
+        if parent is None:  # the root can't be removed
+            return
+        self.__operations[element] = operation
+        self.__parents_involved[parent] = None
+
+    def remove(self, element: ET.Element, keep_tail: bool = False) -> None:
+        """ Remove `element`. With `keep_tail`, its tail text is grafted onto
+        the previous sibling (or the parent's own text when it's the first
+        child), so that the document text surrounding an inline marker
+        survives its removal. """
+        self.__record(element, self.__REMOVE_KEEPING_TAIL if keep_tail else self.__REMOVE)
+
+    def unwrap(self, element: ET.Element) -> None:
+        """ Replace `element` with its children. """
+        self.__record(element, self.__UNWRAP)
+
+    def __new_children(self, parent: ET.Element) -> list[ET.Element]:
+        children: list[ET.Element] = list()
+        for child in parent:
+            operation = self.__operations.get(child)
+            if operation is None:
+                children.append(child)
+            elif operation == self.__UNWRAP:
+                children.extend(self.__new_children(child))
+            elif operation == self.__REMOVE_KEEPING_TAIL and child.tail:
+                if children:
+                    children[-1].tail = (children[-1].tail or '') + child.tail
+                else:
+                    parent.text = (parent.text or '') + child.tail
+        return children
+
+    def apply(self) -> None:
+        """ Apply the recorded operations, in linear time. """
+        for parent in self.__parents_involved:
+            # The children of the elements that are removed don't matter,
+            # and the ones of the unwrapped elements are handled along with
+            # their new parent.
+            if parent in self.__operations:
+                continue
+            children = self.__new_children(parent)
+            parent[:] = children
+            if self.__parents is not None:
+                for child in children:
+                    self.__parents[child] = parent
+        self.__operations.clear()
+        self.__parents_involved.clear()
 
-        namespace_map[key] = value
-        ET.register_namespace(key, value)
 
-    return ET.parse(full_path), namespace_map
+def _xpath(expression: str, namespaces: dict[str, str] | None = None) -> Any:
+    """ Compile `expression` once, for the documents parsed by lxml. """
+    if lxml_etree is None:  # pragma: no cover
+        return None
+    return lxml_etree.XPath(expression, namespaces=namespaces)
 
 
 # The OpenDocument spec fixes these namespace URIs, so matching an element by
@@ -40,38 +233,87 @@ _ODF_OFFICE_NS = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
 _ODF_TEXT_NS = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
 _ODF_TABLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
 
-
-def _remove_element_keeping_tail(parent: ET.Element, element: ET.Element) -> None:
-    """ Remove `element` from `parent`, grafting its tail text onto the previous
-    sibling (or the parent's own text when it's the first child), so that the
-    document text surrounding an inline marker survives its removal. """
-    index = list(parent).index(element)
-    if element.tail:
-        if index == 0:
-            parent.text = (parent.text or '') + element.tail
-        else:
-            previous = parent[index - 1]
-            previous.tail = (previous.tail or '') + element.tail
-    parent.remove(element)
-
-
-def _sort_xml_attributes(full_path: str) -> bool:
-    """ Sort xml attributes lexicographically,
+_WORD_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_STRICT_RELATIONSHIPS_NS = 'http://purl.oclc.org/ooxml/officeDocument/relationships'
+_PACKAGE_RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_PRESENTATION_NS = 'http://schemas.openxmlformats.org/presentationml/2006/main'
+_DRAWING_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+_CHART_NS = 'http://schemas.openxmlformats.org/drawingml/2006/chart'
+_WORD_REVISION_NAMES = {
+    'del', 'ins', 'moveFrom', 'moveTo', 'moveFromRangeStart',
+    'moveFromRangeEnd', 'moveToRangeStart', 'moveToRangeEnd',
+    'cellIns', 'cellDel', 'rPrChange', 'pPrChange', 'sectPrChange',
+    'tblPrChange', 'trPrChange', 'tcPrChange', 'tblGridChange',
+    'numberingChange', 'customXmlInsRangeStart',
+    'customXmlInsRangeEnd', 'customXmlDelRangeStart',
+    'customXmlDelRangeEnd', 'customXmlMoveFromRangeStart',
+    'customXmlMoveFromRangeEnd', 'customXmlMoveToRangeStart',
+    'customXmlMoveToRangeEnd'
+}
+_WORD_REVISION_ATTRIBUTES = {'author', 'date', 'userId', 'initials', 'ed'}
+
+# lxml can filter elements by tag way faster than with XPath, which is
+# only used to find attributes in the documents parsed by lxml.
+_XPATH_RSID_ATTRIBUTES = _xpath("/*//*/@*[namespace-uri() != '' and starts-with(translate(local-name(), 'RSID', 'rsid'), 'rsid')]")
+_XPATH_RELATIONSHIP_ATTRIBUTES = _xpath('//@r:* | //@s:*', {'r': _RELATIONSHIPS_NS,
+                                                              's': _STRICT_RELATIONSHIPS_NS})
+_XPATH_WORD_REVISION_ATTRIBUTES = _xpath(' | '.join('//@w:%s' % name for name in sorted(_WORD_REVISION_ATTRIBUTES)),
+                                         {'w': _WORD_NS})
+
+
+def _canonical_attribute_order(attribute: tuple[str, str]) -> tuple[str, str]:
+    """ Like C14N, order the attributes by namespace URI, then by local
+    name, those without a namespace coming first. """
+    uri, _, local_name = attribute[0].rpartition('}')
+    return uri, local_name
+
+
+def _counter_renumbering(values: Iterable[str]) -> dict[str, str]:
+    """ Map the values of a counter onto 1, 2, 3, …, keeping their order.
+    Returns an empty dict if they already are contiguous, or if they aren't
+    all numbers, in which case they're better left alone. """
+    values = set(values)
+    try:
+        numbers = sorted({int(value) for value in values})
+    except ValueError:
+        return {}
+    if numbers == list(range(1, len(numbers) + 1)):
+        return {}
+    ranks = {number: rank for rank, number in enumerate(numbers, start=1)}
+    return {value: str(ranks[int(value)]) for value in values}
+
+
+def _rel_ids_renumbering(ids: list[str]) -> dict[str, str]:
+    """ Map relationship ids onto rId1, rId2, rId3, …, keeping their order.
+    Returns an empty dict if they already are, or if some are duplicated,
+    since their references would be ambiguous. """
+    if len(set(ids)) != len(ids):  # pragma: no cover
+        return {}
+
+    def _order(rel_id: str) -> tuple[int, int]:
+        number = re.fullmatch('rId([0-9]+)', rel_id)
+        return (0, int(number.group(1))) if number else (1, 0)
+
+    renumbering = {rel_id: 'rId%d' % count
+                   for count, rel_id in enumerate(sorted(ids, key=_order), start=1)}
+    if all(old == new for old, new in renumbering.items()):
+        return {}
+    return renumbering
+
+
+def _sort_xml_attributes(tree: ET.ElementTree) -> None:
+    """ Sort xml attributes in canonical order,
     because it's possible to fingerprint producers (MS Office, Libreoffice, …)
     since they are all using different orders.
     """
-    tree = ET.parse(full_path)
-
     for element in tree.iter():
         if len(element.attrib) < 2:
             continue
-        attributes = sorted(element.attrib.items())
+        attributes = sorted(element.attrib.items(), key=_canonical_attribute_order)
         element.attrib.clear()
         element.attrib.update(attributes)
 
-    tree.write(full_path, xml_declaration=True, encoding='utf-8')
-    return True
-
 
 class MSOfficeParser(ZipParser):
     """
@@ -115,15 +357,11 @@ class MSOfficeParser(ZipParser):
     def __init__(self, filename):
         super().__init__(filename)
 
-        # MSOffice documents are using various counters for cross-references,
-        # we collect them all, to make sure that they're effectively counters,
-        # and not unique id used for fingerprinting.
-        self.__counters = {
-            'cNvPr': set(),
-            'rid': set(),
-            }
         self.__members_to_remove: set[str] | None = None
-        self.__rels_members: dict[str, bytes] | None = None
+        # The relationship graph of the document, computed once from all the
+        # `.rels` members, since a part and its relationships are cleaned
+        # separately, but must stay consistent.
+        self.__relationships: dict[str, tuple[set[str], dict[str, str]]] | None = None
 
         self.files_to_keep = set(map(re.compile, {  # type: ignore
             r'^\[Content_Types\]\.xml$',
@@ -138,7 +376,7 @@ class MSOfficeParser(ZipParser):
             r'^(?:word|ppt|xl)/charts/style[0-9]+\.xml$',
             r'^(?:word|ppt|xl)/drawings/_rels/drawing[0-9]+\.xml\.rels$',
             r'^(?:word|ppt|xl)/styles\.xml$',
-            # TODO: randomize axId ( https://docs.microsoft.com/en-us/openspecs/office_standards/ms-oi29500/089f849f-fcd6-4fa0-a281-35aa6a432a16 )
+            # axId are renumbered ( https://docs.microsoft.com/en-us/openspecs/office_standards/ms-oi29500/089f849f-fcd6-4fa0-a281-35aa6a432a16 )
             r'^(?:word|ppt|xl)/charts/chart[0-9]*\.xml$',
             r'^xl/workbook\.xml$',
             r'^xl/worksheets/sheet[0-9]+\.xml$',
@@ -221,7 +459,7 @@ class MSOfficeParser(ZipParser):
         return True
 
     @staticmethod
-    def __remove_rsid(full_path: str) -> bool:
+    def __remove_rsid(tree: ET.ElementTree, namespace: dict[str, str]) -> None:
         """ The method will remove "revision session ID".  We're using '}rsid'
         instead of proper parsing, since rsid can have multiple forms, like
         `rsidRDefault`, `rsidR`, `rsids`, …
@@ -230,35 +468,32 @@ class MSOfficeParser(ZipParser):
         - https://msdn.microsoft.com/en-us/library/office/documentformat.openxml.wordprocessing.previoussectionproperties.rsidrpr.aspx
         - https://blogs.msdn.microsoft.com/brian_jones/2006/12/11/whats-up-with-all-those-rsids/
         """
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
         # rsid, tags or attributes, are always under the `w` namespace
         if 'w' not in namespace:
-            return True
+            return
 
-        parent_map = {c:p for p in tree.iter() for c in p}
-
-        elements_to_remove = list()
-        for item in tree.iterfind('.//', namespace):
-            if '}rsid' in item.tag.strip().lower():  # rsid as tag
-                elements_to_remove.append(item)
-                continue
-            for key in list(item.attrib.keys()):  # rsid as attribute
-                if '}rsid' in key.lower():
-                    del item.attrib[key]
+        if _is_lxml_tree(tree):
+            elements_to_remove = [element for element in tree.getroot().iterdescendants()  # type: ignore
+                                  if '}rsid' in element.tag.lower()]
+            for attribute in _XPATH_RSID_ATTRIBUTES(tree):
+                del attribute.getparent().attrib[attribute.attrname]
+        else:
+            elements_to_remove = list()
+            for item in tree.iterfind('.//', namespace):
+                if '}rsid' in item.tag.strip().lower():  # rsid as tag
+                    elements_to_remove.append(item)
+                    continue
+                for key in list(item.attrib.keys()):  # rsid as attribute
+                    if '}rsid' in key.lower():
+                        del item.attrib[key]
 
+        index = _ParentIndex(tree)
         for element in elements_to_remove:
-            parent_map[element].remove(element)
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+            index.remove(element)
+        index.apply()
 
     @staticmethod
-    def __remove_nsid(full_path: str) -> bool:
+    def __remove_nsid(tree: ET.ElementTree, namespace: dict[str, str]) -> None:
         """
         nsid are random identifiers that can be used to ease the merging of
         some components of a document.  They can also be used for
@@ -266,59 +501,36 @@ class MSOfficeParser(ZipParser):
 
         See the spec for more details: https://docs.microsoft.com/en-us/dotnet/api/documentformat.openxml.wordprocessing.nsid?view=openxml-2.8.1
         """
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
         # The nsid tag is always under the `w` namespace
         if 'w' not in namespace:
-            return True
-
-        parent_map = {c: p for p in tree.iter() for c in p}
+            return
 
-        elements_to_remove = list()
-        for element in tree.iterfind('.//w:nsid', namespace):
-            elements_to_remove.append(element)
+        if _is_lxml_tree(tree):
+            elements_to_remove = list(tree.getroot().iterdescendants('{%s}nsid' % namespace['w']))  # type: ignore
+        else:
+            elements_to_remove = tree.findall('.//w:nsid', namespace)
+        index = _ParentIndex(tree)
         for element in elements_to_remove:
-            parent_map[element].remove(element)
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+            index.remove(element)
+        index.apply()
 
     @staticmethod
-    def __remove_revisions(full_path: str) -> bool:
-        try:
-            tree, _namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
-        word_namespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
-        revision_names = {
-            'del', 'ins', 'moveFrom', 'moveTo', 'moveFromRangeStart',
-            'moveFromRangeEnd', 'moveToRangeStart', 'moveToRangeEnd',
-            'cellIns', 'cellDel', 'rPrChange', 'pPrChange', 'sectPrChange',
-            'tblPrChange', 'trPrChange', 'tcPrChange', 'tblGridChange',
-            'numberingChange', 'customXmlInsRangeStart',
-            'customXmlInsRangeEnd', 'customXmlDelRangeStart',
-            'customXmlDelRangeEnd', 'customXmlMoveFromRangeStart',
-            'customXmlMoveFromRangeEnd', 'customXmlMoveToRangeStart',
-            'customXmlMoveToRangeEnd'
-        }
-        namespace_prefix = '{%s}' % word_namespace
+    def __remove_revisions(tree: ET.ElementTree) -> None:
+        namespace_prefix = '{%s}' % _WORD_NS
 
         def _tag_local_name(tag: str) -> str:
             return tag.removeprefix(namespace_prefix)
 
-        elements = [element for element in tree.iter()
-                if element.tag.startswith(namespace_prefix) and
-                _tag_local_name(element.tag) in revision_names]
+        if _is_lxml_tree(tree):
+            elements = list(tree.iter(*[namespace_prefix + name for name in _WORD_REVISION_NAMES]))
+        else:
+            elements = [element for element in tree.iter()
+                    if element.tag.startswith(namespace_prefix) and
+                    _tag_local_name(element.tag) in _WORD_REVISION_NAMES]
         if not elements:
-            return True  # No revisions are present
+            return  # No revisions are present
 
-        parent_map = {c:p for p in tree.iter() for c in p}
+        index = _ParentIndex(tree)
 
         elements_del = [element for element in elements if
                         _tag_local_name(element.tag) in {
@@ -335,71 +547,60 @@ class MSOfficeParser(ZipParser):
                             'customXmlMoveToRangeStart',
                             'customXmlMoveToRangeEnd'}]
         for element in elements_del:
-            parent_map[element].remove(element)
+            index.remove(element)
 
         elements_ins = [element for element in elements if
                         _tag_local_name(element.tag) in
                         {'ins', 'moveTo', 'cellIns'}]
 
-        # Keep the children where the wrapper was. The index has to be the
-        # element's position among its own siblings, not its position in a
-        # walk of the whole tree, or the content lands at the end of the
-        # paragraph and the sentence comes out reordered.
+        # Keep the children where the wrapper was, and not at the end of the
+        # paragraph, or the sentence comes out reordered.
         for element in elements_ins:
-            parent = parent_map[element]
-            position = list(parent).index(element)
-            for offset, children in enumerate(list(element)):
-                parent.insert(position + offset, children)
-            if element in parent:
-                parent.remove(element)
+            index.unwrap(element)
+        index.apply()
 
         # Track-change wrappers are removed above, but revision metadata can
         # still remain on regular nodes as w:* attributes. Strip them to avoid
         # leaking editor identity and revision timestamps.
-        revision_attributes = {'author', 'date', 'userId', 'initials', 'ed'}
-        for element in tree.iter():
-            for key in list(element.attrib):
-                if not key.startswith(namespace_prefix):
-                    continue
-                local_name = key.removeprefix(namespace_prefix)
-                if local_name in revision_attributes:
-                    del element.attrib[key]
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+        if _is_lxml_tree(tree):
+            for attribute in _XPATH_WORD_REVISION_ATTRIBUTES(tree):
+                del attribute.getparent().attrib[attribute.attrname]
+        else:
+            for element in tree.iter():
+                for key in list(element.attrib):
+                    if not key.startswith(namespace_prefix):
+                        continue
+                    local_name = key.removeprefix(namespace_prefix)
+                    if local_name in _WORD_REVISION_ATTRIBUTES:
+                        del element.attrib[key]
 
     @staticmethod
-    def __remove_document_comment_meta(full_path: str) -> bool:
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
-        # search the docs to see if we can bail early
-        range_start = tree.find('.//w:commentRangeStart', namespace)
-        range_end = tree.find('.//w:commentRangeEnd', namespace)
-        references = tree.find('.//w:commentReference', namespace)
-        if range_start is None and range_end is None and references is None:
-            return True  # No comment meta tags are present
-
-        parent_map = {c:p for p in tree.iter() for c in p}
+    def __remove_document_comment_meta(tree: ET.ElementTree, namespace: dict[str, str]) -> None:
+        # The comment meta tags are always under the `w` namespace
+        if 'w' not in namespace:
+            return
 
         # iterate over the elements and add them to list
-        elements_del = list()
-        for element in tree.iterfind('.//w:commentRangeStart', namespace):
-            elements_del.append(element)
-        for element in tree.iterfind('.//w:commentRangeEnd', namespace):
-            elements_del.append(element)
-        for element in tree.iterfind('.//w:commentReference', namespace):
-            elements_del.append(element)
+        if _is_lxml_tree(tree):
+            elements_del = list(tree.getroot().iterdescendants(  # type: ignore
+                *['{%s}%s' % (namespace['w'], name) for name in
+                  ('commentRangeStart', 'commentRangeEnd', 'commentReference')]))
+        else:
+            elements_del = list()
+            for element in tree.iterfind('.//w:commentRangeStart', namespace):
+                elements_del.append(element)
+            for element in tree.iterfind('.//w:commentRangeEnd', namespace):
+                elements_del.append(element)
+            for element in tree.iterfind('.//w:commentReference', namespace):
+                elements_del.append(element)
+        if not elements_del:
+            return  # No comment meta tags are present
 
         # remove the elements
+        index = _ParentIndex(tree)
         for element in elements_del:
-            parent_map[element].remove(element)
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+            index.remove(element)
+        index.apply()
 
     def __get_members_to_remove(self) -> set[str]:
         """ The set of members that `remove_all` will drop from the archive. """
@@ -419,16 +620,6 @@ class MSOfficeParser(ZipParser):
         self.__members_to_remove = removed_fnames
         return removed_fnames
 
-    def __get_rels_members(self) -> dict[str, bytes]:
-        """ The content of every `.rels` member, read in a single pass over
-        the archive. """
-        if self.__rels_members is None:
-            with zipfile.ZipFile(self.filename) as zin:
-                self.__rels_members = {name: zin.read(name)
-                                       for name in zin.namelist()
-                                       if name.endswith('.rels')}
-        return self.__rels_members
-
     @staticmethod
     def __resolve_rel_target(base: str, target: str) -> str:
         """ Resolve a relationship `Target` (`../customXml/item1.xml`,
@@ -446,102 +637,152 @@ class MSOfficeParser(ZipParser):
             return target.removeprefix('/')
         return posixpath.normpath(posixpath.join(base, target))
 
-    def __dead_rel_ids(self, member_name: str) -> set[str]:
-        """ The relationship ids of `member_name` that point at a part
-        `remove_all` drops. """
-        rels_name = posixpath.join(posixpath.dirname(member_name), '_rels',
-                                   posixpath.basename(member_name) + '.rels')
-        base = posixpath.dirname(member_name)
-        dead: set[str] = set()
-        content = self.__get_rels_members().get(rels_name)
-        if content is None:
-            return dead
-        try:
-            root = ET.fromstring(content)
-        except ET.ParseError:  # pragma: no cover
-            return dead
+    @staticmethod
+    def __rels_name(member_name: str) -> str:
+        """ The name of the `.rels` member holding the relationships of
+        `member_name`, `_rels/.rels` for the package itself. """
+        return posixpath.join(posixpath.dirname(member_name), '_rels',
+                              posixpath.basename(member_name) + '.rels')
+
+    def __get_relationships(self) -> dict[str, tuple[set[str], dict[str, str]]]:
+        """ Parse every `.rels` member once, in a single pass over the
+        archive, and index by their name the ids of their relationships
+        pointing at a part that `remove_all` drops, and the new ids of the
+        other ones, so that cleaning a part and its relationships is only
+        a matter of looking them up.
+        """
+        if self.__relationships is not None:
+            return self.__relationships
+
         members_to_remove = self.__get_members_to_remove()
-        for item in root:
-            if item.attrib.get('TargetMode') == 'External':
-                continue
-            name = self.__resolve_rel_target(base, item.attrib.get('Target', ''))
-            if not name:
-                continue
-            if name in members_to_remove:
-                dead.add(item.attrib['Id'])
-        return dead
+        relationships: dict[str, tuple[set[str], dict[str, str]]] = dict()
+        with zipfile.ZipFile(self.filename) as zin:
+            for rels_name in zin.namelist():
+                if not rels_name.endswith('.rels'):
+                    continue
+                try:
+                    root = ET.fromstring(zin.read(rels_name))
+                except ET.ParseError:  # pragma: no cover
+                    continue
 
-    def __remove_dead_rel_references(self, full_path: str, member_name: str) -> bool:
-        """ Drop the `r:id`/`r:embed`/… attributes pointing at relationships
-        that `__remove_rels_members` takes away, so that the part doesn't
-        reference a relationship that no longer exists. """
-        dead = self.__dead_rel_ids(member_name)
-        if not dead:
-            return True
+                # Relationship targets are resolved against the folder
+                # holding the `_rels` directory: `word` for
+                # `word/_rels/document.xml.rels`, so that `../customXml/item1.xml`
+                # refers to `customXml/item1.xml`, and the package root for
+                # `_rels/.rels`.
+                base = posixpath.dirname(posixpath.dirname(rels_name))
+                dead: set[str] = set()
+                ids: list[str] = list()
+                for item in root.findall('{%s}Relationship' % _PACKAGE_RELATIONSHIPS_NS):
+                    rel_id = item.attrib.get('Id', '')
+                    if item.attrib.get('TargetMode') != 'External':
+                        name = self.__resolve_rel_target(base, item.attrib.get('Target', ''))
+                        if name and name in members_to_remove:
+                            dead.add(rel_id)
+                            continue
+                    ids.append(rel_id)
 
-        try:
-            tree, _ = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
+                # The references from the parts we don't rewrite, like
+                # the `o:relid` of the VML drawings, can't be updated.
+                source = posixpath.basename(rels_name).removesuffix('.rels')
+                if source and not source.endswith('.xml'):
+                    relationships[rels_name] = (dead, dict())
+                else:
+                    relationships[rels_name] = (dead, _rel_ids_renumbering(ids))
 
-        namespace = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
-        changed = False
-        for element in tree.iter():
-            for key in [k for k, v in element.attrib.items()
-                        if k.startswith(namespace) and v in dead]:
-                del element.attrib[key]
-                changed = True
+        self.__relationships = relationships
+        return relationships
 
-        if changed:
-            tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+    def __dead_rel_ids(self, member_name: str) -> set[str]:
+        """ The relationship ids of `member_name` that point at a part
+        `remove_all` drops. """
+        return self.__get_relationships().get(self.__rels_name(member_name), (set(), dict()))[0]
+
+    def __renumbered_rel_ids(self, member_name: str) -> dict[str, str]:
+        """ The new ids of the relationships of `member_name`. """
+        return self.__get_relationships().get(self.__rels_name(member_name), (set(), dict()))[1]
+
+    def __renumber_ids(self, tree: ET.ElementTree, namespace: dict[str, str],
+                       member_name: str) -> None:
+        """ Randomize the `p14:creationId`s, and make sure that the ids
+        meant to be counters are effectively counters, and not unique ids
+        usable for fingerprinting, or leftovers from removed content:
+            - the relationship ids (`r:id`, `r:embed`, …) pointing at
+              a removed part are dropped, and the other ones follow the
+              renumbering of the `.rels` done by `__remove_rels_members`;
+            - the shape ids of the slides (`p:cNvPr`), along with their
+              references from the connectors and the animations;
+            - the axis ids of the charts (`c:axId`), usually random,
+              along with their `c:crossAx` references.
+        """
+        def _renumber(references: list[tuple[Any, str]], renumbering: dict[str, str]) -> None:
+            for element, key in references:
+                value = element.get(key)
+                if value in renumbering:
+                    element.set(key, renumbering[value])
 
-    def __remove_rels_members(self, full_path: str, member_name: str) -> bool:
-        """ Remove the dangling references from a `.rels` file, since MS Office
-        doesn't like them.
+        if 'p14' in namespace:
+            for item in tree.iter('{%s}creationId' % namespace['p14']):
+                item.set('val', '%s' % random.randint(0, 2**32))
 
-        Relationship targets are resolved against the folder holding the
-        `_rels` directory, so `word/_rels/document.xml.rels` pointing at
-        `../customXml/item1.xml` refers to `customXml/item1.xml`.
+        dead = self.__dead_rel_ids(member_name)
+        rel_ids = self.__renumbered_rel_ids(member_name)
+        if dead or rel_ids:
+            # Strict OOXML parts are using their own namespace.
+            rels_namespaces = ('{%s}' % _RELATIONSHIPS_NS, '{%s}' % _STRICT_RELATIONSHIPS_NS)
+            if _is_lxml_tree(tree):
+                references = [(attribute.getparent(), attribute.attrname)
+                              for attribute in _XPATH_RELATIONSHIP_ATTRIBUTES(tree)]
+            else:
+                references = [(element, key) for element in tree.iter()
+                              for key in element.attrib if key.startswith(rels_namespaces)]
+            for element, key in references:
+                if element.get(key) in dead:
+                    del element.attrib[key]
+            _renumber(references, rel_ids)
+
+        if _PRESENTATION_NS in namespace.values():
+            shapes = [(shape, 'id') for shape in tree.iter('{%s}cNvPr' % _PRESENTATION_NS)]
+            shape_ids = _counter_renumbering(shape.attrib['id'] for shape, _ in shapes
+                                             if 'id' in shape.attrib)
+            if shape_ids:
+                for tag in ('stCxn', 'endCxn'):
+                    shapes += [(connection, 'id') for connection
+                               in tree.iter('{%s}%s' % (_DRAWING_NS, tag))]
+                # `p:spTgt`, `p:bldP`, … in the animations
+                shapes += [(target, 'spid') for target in tree.iterfind('.//*[@spid]')]
+                _renumber(shapes, shape_ids)
+
+        if _CHART_NS in namespace.values():
+            axes = [(axis, 'val') for tag in ('axId', 'crossAx')
+                    for axis in tree.iter('{%s}%s' % (_CHART_NS, tag))]
+            _renumber(axes, _counter_renumbering(axis.attrib['val'] for axis, _ in axes
+                                                 if 'val' in axis.attrib))
+
+    def __remove_rels_members(self, tree: ET.ElementTree, namespace: dict[str, str],
+                              member_name: str) -> None:
+        """ Remove the dangling references from a `.rels` file, since MS Office
+        doesn't like them, and renumber the remaining ones.
         """
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
+        dead, rel_ids = self.__get_relationships().get(member_name, (set(), dict()))
+        if not dead and not rel_ids:
+            return
 
         if len(namespace.items()) != 1:  # pragma: no cover
             logging.getLogger(__name__).debug("Got several namespaces for Types: %s", namespace.items())
 
-        members_to_remove = self.__get_members_to_remove()
-        # the base is `word` for `word/_rels/document.xml.rels`,
-        # and the package root for `_rels/.rels`
-        base = posixpath.dirname(posixpath.dirname(member_name))
-
         root = tree.getroot()
-        for item in root.findall('{%s}Relationship' % namespace['']):
-            if item.attrib.get('TargetMode') == 'External':
-                continue
-            name = self.__resolve_rel_target(base, item.attrib['Target'])
-            if not name:  # a link to a bookmark, not to a part
-                continue
-            if name in members_to_remove:
+        for item in list(root):
+            rel_id = item.attrib.get('Id', '')
+            if rel_id in dead:
                 root.remove(item)
+            elif rel_id in rel_ids:
+                item.set('Id', rel_ids[rel_id])
 
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
-
-    def __remove_content_type_members(self, full_path: str) -> bool:
+    def __remove_content_type_members(self, tree: ET.ElementTree, namespace: dict[str, str]) -> None:
         """ The method will remove the dangling references
         form the [Content_Types].xml file, since MS office doesn't like them
         """
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
         if len(namespace.items()) != 1:  # pragma: no cover
             logging.getLogger(__name__).debug("Got several namespaces for Types: %s", namespace.items())
 
@@ -553,133 +794,81 @@ class MSOfficeParser(ZipParser):
             if name in members_to_remove:
                 root.remove(item)
 
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
-
-    def _final_checks(self) -> bool:
-        for k, v in self.__counters.items():
-            if v and len(v) != max(v):
-                # TODO: make this an error and return False
-                # once the ability to correct the counters is implemented
-                logging.warning("%s contains invalid %s: %s", self.filename, k, v)
-                return True
-        return True
-
-    def __collect_counters(self, full_path: str):
-        with open(full_path, encoding='utf-8') as f:
-            content = f.read()
-            # "relationship Id"
-            for i in re.findall(r'(?:\s|r:)[iI][dD]="rId([0-9]+)"(?:\s|/)', content):
-                self.__counters['rid'].add(int(i))
-            # "connector for Non-visual property"
-            for i in re.findall(r'<p:cNvPr id="([0-9]+)"', content):
-                self.__counters['cNvPr'].add(int(i))
-
-    @staticmethod
-    def __randomize_creationId(full_path: str) -> bool:
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
-        if 'p14' not in namespace:
-            return True  # pragma: no cover
-
-        for item in tree.iterfind('.//p14:creationId', namespace):
-            item.set('val', '%s' % random.randint(0, 2**32))
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
-
     @staticmethod
-    def __randomize_sldMasterId(full_path: str) -> bool:
-        try:
-            tree, namespace = _parse_xml(full_path)
-        except ET.ParseError as e:  # pragma: no cover
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
+    def __randomize_sldMasterId(tree: ET.ElementTree, namespace: dict[str, str]) -> None:
         if 'p' not in namespace:
-            return True  # pragma: no cover
+            return  # pragma: no cover
 
-        for item in tree.iterfind('.//p:sldMasterId', namespace):
+        if _is_lxml_tree(tree):
+            items = tree.getroot().iterdescendants('{%s}sldMasterId' % namespace['p'])  # type: ignore
+        else:
+            items = tree.findall('.//p:sldMasterId', namespace)
+        for item in items:
             item.set('id', '%s' % random.randint(0, 2**32))
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
 
     def _specific_cleanup(self, full_path: str, member_name: str = '') -> bool:
-        # pylint: disable=too-many-return-statements,too-many-branches
+        # pylint: disable=too-many-branches
         if os.stat(full_path).st_size == 0:  # Don't process empty files
             return True
 
         if not full_path.endswith(('.xml', '.rels')):
             return True
 
-        if self.__randomize_creationId(full_path) is False:
-            return False
-
-        self.__collect_counters(full_path)
-
-        if not member_name.endswith('.rels'):
-            # the part might point at relationships that are about to go away
-            if self.__remove_dead_rel_references(full_path, member_name) is False:  # pragma: no cover
-                return False
-
-        if full_path.endswith('/[Content_Types].xml'):
-            # this file contains references to files that we might
-            # remove, and MS Office doesn't like dangling references
-            if self.__remove_content_type_members(full_path) is False:  # pragma: no cover
-                return False
-        elif member_name.startswith('word/') and member_name.endswith('.xml'):
-            # Revisions can occur in the document, notes, headers and footers.
-            if self.__remove_revisions(full_path) is False:
-                return False  # pragma: no cover
-            if full_path.endswith('/word/document.xml'):
-                # remove comment references and ranges
-                if self.__remove_document_comment_meta(full_path) is False:
-                    return False  # pragma: no cover
-        elif member_name.endswith('.rels'):
-            # similar to the above, but for the relationship files
-            if self.__remove_rels_members(full_path, member_name) is False:  # pragma: no cover
-                return False
-
-        elif full_path.endswith('/docProps/app.xml'):
-            # This file must be present and valid,
-            # so we're removing as much as we can.
-            with open(full_path, 'wb') as f:
-                f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
-                f.write(b'<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">')
-                f.write(b'</Properties>')
+        # Those files must be present and valid,
+        # so we're removing as much as we can.
+        placeholder = None
+        if full_path.endswith('/docProps/app.xml'):
+            placeholder = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                           b'<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+                           b'</Properties>')
         elif full_path.endswith('/docProps/core.xml'):
-            # This file must be present and valid,
-            # so we're removing as much as we can.
-            with open(full_path, 'wb') as f:
-                f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
-                f.write(b'<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties">')
-                f.write(b'</cp:coreProperties>')
+            placeholder = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                           b'<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties">'
+                           b'</cp:coreProperties>')
         elif full_path.endswith('/ppt/tableStyles.xml'):  # pragma: no cover
-            # This file must be present and valid,
-            # so we're removing as much as we can.
-            with open(full_path, 'wb') as f:
-                f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
-                uid = str(uuid.uuid4()).encode('utf-8')
-                f.write(b'<a:tblStyleLst def="{%s}" xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"/>' % uid)
-        elif full_path.endswith('ppt/presentation.xml'):
-            if self.__randomize_sldMasterId(full_path) is False:
-                return False  # pragma: no cover
-
-        if self.__remove_rsid(full_path) is False:
-            return False  # pragma: no cover
-
-        if self.__remove_nsid(full_path) is False:
-            return False  # pragma: no cover
+            uid = str(uuid.uuid4()).encode('utf-8')
+            placeholder = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                           b'<a:tblStyleLst def="{%s}" xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"/>' % uid)
 
+        # Every part is parsed once, goes through all the passes,
+        # and is written once.
         try:
-            _sort_xml_attributes(full_path)
-        except ET.ParseError as e:  # pragma: no cover
+            if placeholder is None:
+                tree, namespace = _parse_xml(full_path)
+            else:
+                tree, namespace = _parse_xml_data(placeholder)
+        except ET.ParseError as e:
             logging.error("Unable to parse %s: %s", full_path, e)
             return False
 
+        if member_name.endswith('.rels'):
+            # this file contains references to parts that we might
+            # remove, and MS Office doesn't like dangling references
+            self.__remove_rels_members(tree, namespace, member_name)
+        elif placeholder is None:
+            # the part might point at relationships that are about to go away,
+            # or be renumbered
+            self.__renumber_ids(tree, namespace, member_name)
+
+            if full_path.endswith('/[Content_Types].xml'):
+                # similar to the above, but for the content types
+                self.__remove_content_type_members(tree, namespace)
+            elif member_name.startswith('word/') and member_name.endswith('.xml'):
+                # Revisions can occur in the document, notes, headers and footers.
+                self.__remove_revisions(tree)
+                if full_path.endswith('/word/document.xml'):
+                    # remove comment references and ranges
+                    self.__remove_document_comment_meta(tree, namespace)
+            elif full_path.endswith('ppt/presentation.xml'):
+                self.__randomize_sldMasterId(tree, namespace)
+
+        self.__remove_rsid(tree, namespace)
+        self.__remove_nsid(tree, namespace)
+        _sort_xml_attributes(tree)
+
+        output = io.BytesIO()
+        _write_xml(tree, output, namespace)
+
         # This is awful, I'm sorry.
         #
         # Microsoft Office isn't happy when we have the `mc:Ignorable`
@@ -688,16 +877,17 @@ class MSOfficeParser(ZipParser):
         # we're removing it, with a regexp.
         #
         # Since we're the ones producing this file, via the call to
-        # _sort_xml_attributes, there won't be any "funny tricks".
+        # _write_xml, there won't be any "funny tricks".
         # Worst case, the tag isn't present, and everything is fine.
         #
         # see: https://docs.microsoft.com/en-us/dotnet/framework/wpf/advanced/mc-ignorable-attribute
-        with open(full_path, 'rb') as f:
-            text = f.read()
-            out = re.sub(b'mc:Ignorable="[^"]*"', b'', text, count=1)
         with open(full_path, 'wb') as f:
-            f.write(out)
+            f.write(re.sub(b'mc:Ignorable="[^"]*"', b'', output.getvalue(), count=1))
+
+        return True
 
+    def has_metadata(self) -> bool:
+        # rsids, revisions, comments, … aren't reported by get_meta
         return True
 
     def _specific_get_meta(self, full_path: str, file_path: str) -> dict[str, Any]:
@@ -751,16 +941,7 @@ class LibreOfficeParser(ZipParser):
         }))
 
     @staticmethod
-    def __remove_revisions(full_path: str) -> bool:
-        try:
-            tree, _namespace = _parse_xml(full_path)
-        except ET.ParseError as e:
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
-        root = tree.getroot()
-        parent_map = {c: p for p in root.iter() for c in p}
-
+    def __remove_revisions(tree: ET.ElementTree) -> None:
         # Tracked changes live under `office:text` (text documents) as
         # `text:tracked-changes` and under `office:spreadsheet` as
         # `table:tracked-changes`; either way the container carries the deleted
@@ -777,62 +958,62 @@ class LibreOfficeParser(ZipParser):
         }
         # The inline `change`/`change-start`/`change-end` markers carry the
         # inserted and surrounding document text in their tail, which
-        # `_remove_element_keeping_tail` preserves.
-        for element in [e for e in root.iter() if e.tag in revision_tags]:
-            parent = parent_map.get(element)
-            if parent is not None:
-                _remove_element_keeping_tail(parent, element)
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+        # is preserved.
+        if _is_lxml_tree(tree):
+            elements = list(tree.iter(*revision_tags))
+        else:
+            elements = [e for e in tree.iter() if e.tag in revision_tags]
+        index = _ParentIndex(tree)
+        for element in elements:
+            index.remove(element, keep_tail=True)
+        index.apply()
 
     @staticmethod
-    def __remove_annotations(full_path: str) -> bool:
-        try:
-            tree, _namespace = _parse_xml(full_path)
-        except ET.ParseError as e:
-            logging.error("Unable to parse %s: %s", full_path, e)
-            return False
-
-        root = tree.getroot()
-        parent_map = {c: p for p in root.iter() for c in p}
-
+    def __remove_annotations(tree: ET.ElementTree) -> None:
         # Comments are stored inline as an `office:annotation` (holding the
         # author, date, initials and the comment body) paired with an
         # `office:annotation-end` marker. Drop both entirely, like the MS
         # Office parser does; the commented-on document text lives in their
-        # tail and is preserved by `_remove_element_keeping_tail`.
+        # tail and is preserved.
         annotation_tags = {
             '{%s}annotation' % _ODF_OFFICE_NS,
             '{%s}annotation-end' % _ODF_OFFICE_NS,
         }
-        for element in [e for e in root.iter() if e.tag in annotation_tags]:
-            parent = parent_map.get(element)
-            if parent is not None:
-                _remove_element_keeping_tail(parent, element)
-
-        tree.write(full_path, xml_declaration=True, encoding='utf-8')
-        return True
+        if _is_lxml_tree(tree):
+            elements = list(tree.iter(*annotation_tags))
+        else:
+            elements = [e for e in tree.iter() if e.tag in annotation_tags]
+        index = _ParentIndex(tree)
+        for element in elements:
+            index.remove(element, keep_tail=True)
+        index.apply()
 
     def _specific_cleanup(self, full_path: str, member_name: str = '') -> bool:
         if os.stat(full_path).st_size == 0:  # Don't process empty files
             return True
 
-        if os.path.basename(full_path).endswith('.xml'):
-            # Tracked changes live in the body (`content.xml`, including an
-            # embedded `Object N/content.xml`); comments can additionally live
-            # in headers and footers, which are stored in `styles.xml`.
-            if os.path.basename(full_path) in ('content.xml', 'styles.xml'):
-                if self.__remove_revisions(full_path) is False:
-                    return False
-                if self.__remove_annotations(full_path) is False:
-                    return False
+        if not os.path.basename(full_path).endswith('.xml'):
+            return True
 
-            try:
-                _sort_xml_attributes(full_path)
-            except ET.ParseError as e:
-                logging.error("Unable to parse %s: %s", full_path, e)
-                return False
+        try:
+            tree, namespace = _parse_xml(full_path)
+        except ET.ParseError as e:
+            logging.error("Unable to parse %s: %s", full_path, e)
+            return False
+
+        # Tracked changes live in the body (`content.xml`, including an
+        # embedded `Object N/content.xml`); comments can additionally live
+        # in headers and footers, which are stored in `styles.xml`.
+        if os.path.basename(full_path) in ('content.xml', 'styles.xml'):
+            self.__remove_revisions(tree)
+            self.__remove_annotations(tree)
+
+        _sort_xml_attributes(tree)
+        _write_xml(tree, full_path, namespace)
+        return True
+
+    def has_metadata(self) -> bool:
+        # rsids, revisions, comments, … aren't reported by get_meta
         return True
 
     def _specific_get_meta(self, full_path: str, file_path: str) -> dict[str, Any]:
@@ -1,17 +1,21 @@
 from __future__ import annotations
 
+import contextlib
 import glob
 import os
 import mimetypes
 import importlib
-from typing import TypeVar
+import shutil
+import tempfile
+from typing import IO, Iterator, TypeVar
 
-from . import abstract, UNSUPPORTED_EXTENSIONS
+from . import abstract, UNSUPPORTED_EXTENSIONS, UnknownMemberPolicy
 
 T = TypeVar('T', bound='abstract.AbstractParser')
 
 mimetypes.add_type('application/epub+zip', '.epub')
 mimetypes.add_type('application/x-dtbncx+xml', '.ncx')  # EPUB Navigation Control XML File
+mimetypes.add_type('image/x-portable-arbitrarymap', '.pam')
 
 # This should be removed after we move to python3.10
 # https://github.com/python/cpython/commit/20a5b7e986377bdfd929d7e8c4e3db5847dfdb2d
@@ -42,11 +46,17 @@ def _get_parsers() -> list[T]:
     return __get_parsers(abstract.AbstractParser)
 
 
-def get_parser(filename: str) -> tuple[T | None, str | None]:
-    """ Return the appropriate parser for a given filename.
+def _get_parser_class(mtype: str | None) -> type[T] | None:
+    """ Return the parser class handling the given mimetype. """
+    for parser_class in _get_parsers():  # type: ignore
+        if mtype in parser_class.mimetypes:
+            return parser_class  # type: ignore
+    return None
 
-        :raises ValueError: Raised if the instantiation of the parser went wrong.
-    """
+
+def get_parser_class(filename: str) -> tuple[type[T] | None, str | None]:
+    """ Return the class of the appropriate parser for a given filename,
+    without instantiating it. """
     mtype, _ = mimetypes.guess_type(filename)
 
     _, extension = os.path.splitext(filename)
@@ -57,8 +67,109 @@ def get_parser(filename: str) -> tuple[T | None, str | None]:
         if extension[1:] in ('bz2', 'gz', 'xz'):
             mtype = mtype + '+' + extension[1:]
 
-    for parser_class in _get_parsers():  # type: ignore
-        if mtype in parser_class.mimetypes:
-            # This instantiation might raise a ValueError on malformed files
-            return parser_class(filename), mtype
-    return None, mtype
+    return _get_parser_class(mtype), mtype
+
+
+def get_parser(filename: str) -> tuple[T | None, str | None]:
+    """ Return the appropriate parser for a given filename.
+
+        :raises ValueError: Raised if the instantiation of the parser went wrong.
+    """
+    parser_class, mtype = get_parser_class(filename)
+    if parser_class is None:
+        return None, mtype
+    # This instantiation might raise a ValueError on malformed files
+    return parser_class(filename), mtype  # type: ignore
+
+
+def _get_tmpfs_dir() -> str | None:
+    """ Return a memory-backed folder to put temporary files in,
+    or None to use the default temporary folder. """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK | os.X_OK):
+        return '/dev/shm'
+    return None  # pragma: no cover
+
+
+def _get_extension(mtype: str) -> str | None:
+    """ Return an extension that `get_parser` maps back to `mtype`. """
+    if mtype.startswith('application/x-tar+'):
+        return '.tar.' + mtype[len('application/x-tar+'):]
+    return mimetypes.guess_extension(mtype)
+
+
+def clean_bytes(data: bytes, mimetype: str, lightweight: bool = False,
+                policy: UnknownMemberPolicy | None = None) -> bytes:
+    """ Return a cleaned version of `data`, whose format is `mimetype`.
+
+    The cleaning is done in memory when the parser's backend allows it,
+    the other ones are fed with a temporary file, on a tmpfs if possible.
+
+        :raises ValueError: Raised upon unsupported or invalid data.
+        :raises RuntimeError: Raised if the cleaning process went wrong.
+    """
+    parser_class = _get_parser_class(mimetype)
+    if parser_class is None:
+        raise ValueError("The format %s is not supported" % mimetype)
+
+    cleaned = parser_class._remove_all_in_memory(data, lightweight)
+    if cleaned is not None:
+        return cleaned
+
+    with _temporary_file(data, mimetype) as fname:
+        p = parser_class(fname)  # type: ignore
+        p.lightweight_cleaning = lightweight
+        if policy is not None:
+            p.unknown_member_policy = policy
+        if p.remove_all() is not True:
+            raise RuntimeError("Unable to clean the %s data" % mimetype)
+        with open(p.output_filename, 'rb') as f:
+            return f.read()
+
+
+def get_meta_bytes(data: bytes, mimetype: str) -> dict[str, str | dict]:
+    """ Return the metadata of `data`, whose format is `mimetype`.
+
+    Like `clean_bytes`, this is done in memory when the parser's backend
+    allows it, and with a temporary file otherwise.
+
+        :raises ValueError: Raised upon unsupported or invalid data.
+    """
+    parser_class = _get_parser_class(mimetype)
+    if parser_class is None:
+        raise ValueError("The format %s is not supported" % mimetype)
+
+    meta = parser_class._get_meta_in_memory(data)
+    if meta is not None:
+        return meta
+
+    with _temporary_file(data, mimetype) as fname:
+        return parser_class(fname).get_meta()  # type: ignore
+
+
+@contextlib.contextmanager
+def _temporary_file(data: bytes, mimetype: str) -> Iterator[str]:
+    """ Yield the path of a temporary file holding `data`, for the parsers
+    whose backend can only work on files. """
+    extension = _get_extension(mimetype)
+    if extension is None:  # pragma: no cover
+        raise ValueError("Unable to find an extension for %s" % mimetype)
+
+    temp_folder = tempfile.mkdtemp(dir=_get_tmpfs_dir())
+    try:
+        fname = os.path.join(temp_folder, 'data' + extension)
+        with open(fname, 'wb') as f:
+            f.write(data)
+        yield fname
+    finally:
+        shutil.rmtree(temp_folder)
+
+
+def clean_fileobj(fin: IO[bytes], fout: IO[bytes], mimetype: str,
+                  lightweight: bool = False,
+                  policy: UnknownMemberPolicy | None = None) -> None:
+    """ Write a cleaned version of the content of `fin` into `fout`.
+
+        :raises ValueError: Raised upon unsupported or invalid data.
+        :raises RuntimeError: Raised if the cleaning process went wrong.
+    """
+    fout.write(clean_bytes(fin.read(), mimetype, lightweight, policy))
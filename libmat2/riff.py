@@ -0,0 +1,290 @@
+""" Native handling of RIFF (WAV, AVI) and IFF (AIFF) files, which are
+simple sequences of chunks, to avoid going through ffmpeg and exiftool. """
+
+from __future__ import annotations
+
+import io
+import os
+import struct
+from typing import IO, Iterator
+
+import mutagen.id3
+
+from . import fastcopy
+
+# Names of the metadata, as exiftool reports them.
+_INFO_TAGS = {
+    b'IARL': 'ArchivalLocation', b'IART': 'Artist', b'ICMS': 'Commissioned',
+    b'ICMT': 'Comment', b'ICOP': 'Copyright', b'ICRD': 'DateCreated',
+    b'ICRP': 'Cropped', b'IDIM': 'Dimensions', b'IDPI': 'DotsPerInch',
+    b'IENG': 'Engineer', b'IGNR': 'Genre', b'IKEY': 'Keywords',
+    b'ILGT': 'Lightness', b'IMED': 'Medium', b'INAM': 'Title',
+    b'IPLT': 'NumColors', b'IPRD': 'Product', b'ISBJ': 'Subject',
+    b'ISFT': 'Software', b'ISHP': 'Sharpness', b'ISRC': 'Source',
+    b'ISRF': 'SourceForm', b'ITCH': 'Technician', b'ITRK': 'TrackNumber',
+    b'IDIT': 'DateTimeOriginal', b'ISMP': 'TimeCode', b'strn': 'StreamName',
+}
+_AIFF_TAGS = {
+    b'NAME': 'Name', b'AUTH': 'Author', b'(c) ': 'Copyright',
+    b'ANNO': 'Annotation', b'COMT': 'Comment',
+}
+
+# Chunks kept by the cleaning, every other one being removed.
+_WAV_KEPT = {b'fmt ', b'fact', b'data'}
+_AIFF_KEPT = {b'COMM', b'SSND', b'FVER'}
+
+# Chunks only used for padding, that aren't metadata by themselves.
+_PADDING = {b'JUNK', b'PAD ', b'FLLR', b'junk', b'pad '}
+
+# AVI chunks that are overwritten with zeroes, and LIST chunks
+# whose content is, instead of being removed, so that the offsets
+# of the index don't change.
+_AVI_BLANKED = {b'JUNK', b'IDIT', b'ISMP', b'strn'}
+_AVI_BLANKED_LISTS = {b'INFO', b'ncdt'}
+_AVI_LISTS = {b'hdrl', b'strl', b'odml'}
+
+_BUFFER_SIZE = 1024 * 1024
+
+
+class _Form:
+    """ The description of a RIFF/IFF flavour. """
+    def __init__(self, magic: bytes, types: set[bytes], byteorder: str,
+                 kept: set[bytes], required: set[bytes]) -> None:
+        self.magic = magic
+        self.types = types
+        self.header = struct.Struct(byteorder + '4sI')
+        self.kept = kept
+        self.required = required
+
+
+_WAV = _Form(b'RIFF', {b'WAVE'}, '<', _WAV_KEPT, {b'fmt ', b'data'})
+_AIFF = _Form(b'FORM', {b'AIFF', b'AIFC'}, '>', _AIFF_KEPT, {b'COMM'})
+_AVI = _Form(b'RIFF', {b'AVI ', b'AVIX'}, '<', set(), set())
+
+
+def _iter_chunks(f: IO[bytes], form: _Form, start: int,
+                 end: int) -> Iterator[tuple[bytes, int, int]]:
+    """ Yield the identifier, the start of the data
+    and the size of the chunks contained in f[start:end]. """
+    position = start
+    while position + form.header.size <= end:
+        f.seek(position)
+        chunk_id, size = form.header.unpack(f.read(form.header.size))
+        position += form.header.size
+        if position + size > end:
+            raise ValueError('Invalid size for the chunk %r' % chunk_id)
+        yield chunk_id, position, size
+        position += size + (size & 1)
+    if position < end - 1:  # the last padding byte is sometimes missing
+        raise ValueError('Truncated chunk header')
+
+
+def _read_forms(f: IO[bytes], form: _Form) -> Iterator[tuple[bytes, int, int]]:
+    """ Yield the type, the start and the end of the top-level forms of `f`.
+    Only AVI files are allowed to have several of them. """
+    file_size = f.seek(0, os.SEEK_END)
+    position = 0
+    while position + 12 <= file_size:
+        f.seek(position)
+        magic, size = form.header.unpack(f.read(form.header.size))
+        form_type = f.read(4)
+        if magic != form.magic or form_type not in form.types:
+            if position:  # trailing garbage
+                return
+            raise ValueError('Not a %r file' % form.types)
+        if size < 4 or position + 8 + size > file_size:
+            raise ValueError('Invalid size for the %r form' % form_type)
+        yield form_type, position + 12, position + 8 + size
+        position += 8 + size + (size & 1)
+        if form is not _AVI:
+            return
+    if not position:
+        raise ValueError('Truncated file')
+
+
+def _clean_chunks(input_filename: str, output_filename: str, form: _Form) -> None:
+    with open(input_filename, 'rb') as fin:
+        form_type, start, end = next(_read_forms(fin, form))
+        chunks = [chunk for chunk in _iter_chunks(fin, form, start, end)
+                  if chunk[0] in form.kept]
+        if not form.required.issubset(chunk[0] for chunk in chunks):
+            raise ValueError('Missing mandatory chunks')
+        size = 4 + sum(form.header.size + size + (size & 1) for _, _, size in chunks)
+        if size > 0xffffffff:  # pragma: no cover
+            raise ValueError('File too large')
+
+        try:
+            with open(output_filename, 'wb') as fout:
+                fout.write(form.header.pack(form.magic, size) + form_type)
+                for chunk_id, chunk_start, chunk_size in chunks:
+                    fout.write(form.header.pack(chunk_id, chunk_size))
+                    fout.flush()
+                    fastcopy.copy_range(fin.fileno(), fout.fileno(), chunk_start, chunk_size)
+                    if chunk_size & 1:
+                        fout.write(b'\x00')
+        except OSError:
+            os.remove(output_filename)
+            raise
+
+
+def clean_wav(input_filename: str, output_filename: str) -> None:
+    """ Write `input_filename` to `output_filename`, keeping only the chunks
+    needed to play it.
+
+    :raises ValueError: Raised if the file is invalid, or not supported.
+    """
+    _clean_chunks(input_filename, output_filename, _WAV)
+
+
+def clean_aiff(input_filename: str, output_filename: str) -> None:
+    """ Same as `clean_wav`, but for AIFF and AIFF-C files. """
+    _clean_chunks(input_filename, output_filename, _AIFF)
+
+
+def _iter_avi_chunks(f: IO[bytes], start: int,
+                     end: int) -> Iterator[tuple[bytes, bytes | None, int, int]]:
+    """ Yield the identifier, the type of LIST chunks, the start of the
+    header and the end of the chunks of an AVI file, without going into
+    the media data. """
+    for chunk_id, chunk_start, size in _iter_chunks(f, _AVI, start, end):
+        list_type = None
+        if chunk_id == b'LIST':
+            if size < 4:
+                raise ValueError('Truncated LIST chunk')
+            f.seek(chunk_start)
+            list_type = f.read(4)
+        yield chunk_id, list_type, chunk_start - 8, chunk_start + size
+        if list_type in _AVI_LISTS:
+            yield from _iter_avi_chunks(f, chunk_start + 4, chunk_start + size)
+
+
+def clean_avi(input_filename: str, output_filename: str) -> None:
+    """ Copy `input_filename` to `output_filename`, and replace its metadata
+    chunks with zero-filled JUNK ones: the index of AVI files might be
+    referencing the chunks by their absolute offset, so nothing can move.
+
+    :raises ValueError: Raised if the file is invalid, or not supported.
+    """
+    blanked = list()
+    with open(input_filename, 'rb') as f:
+        forms = list(_read_forms(f, _AVI))
+        if forms[0][0] != b'AVI ':
+            raise ValueError('Not an AVI file')
+        for _, start, end in forms:
+            for chunk_id, list_type, chunk_start, chunk_end in _iter_avi_chunks(f, start, end):
+                if chunk_id in _AVI_BLANKED or list_type in _AVI_BLANKED_LISTS:
+                    blanked.append((chunk_start, chunk_end))
+    end = forms[-1][2]
+
+    try:
+        fastcopy.copy_file(input_filename, output_filename)
+        with open(output_filename, 'r+b') as f:
+            f.truncate(end)  # trailing garbage
+            for chunk_start, chunk_end in blanked:
+                f.seek(chunk_start)
+                f.write(_AVI.header.pack(b'JUNK', chunk_end - chunk_start - 8))
+                remaining = chunk_end - chunk_start - 8
+                while remaining:
+                    remaining -= f.write(bytes(min(remaining, _BUFFER_SIZE)))
+    except OSError:
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        raise
+
+
+def _decode(data: bytes) -> str:
+    data = data.rstrip(b'\x00')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def _get_id3_meta(data: bytes) -> dict[str, str | dict]:
+    try:
+        tags = mutagen.id3.ID3(io.BytesIO(data))
+    except mutagen.MutagenError:
+        return {'ID3': '(Binary data %d bytes)' % len(data)}
+    return {k.rstrip(' \t\r\n\0'): ', '.join(map(str, v.text))
+            for k, v in tags.items() if hasattr(v, 'text')}
+
+
+def _get_aiff_comments(data: bytes) -> str:
+    """ The COMT chunk is a list of timestamped comments. """
+    comments = list()
+    if len(data) < 2:
+        raise ValueError('Truncated COMT chunk')
+    count, = struct.unpack('>H', data[:2])
+    position = 2
+    for _ in range(count):
+        if position + 8 > len(data):
+            raise ValueError('Truncated COMT chunk')
+        size, = struct.unpack('>H', data[position + 6:position + 8])
+        position += 8
+        comments.append(_decode(data[position:position + size]))
+        position += size + (size & 1)
+    return ', '.join(comments)
+
+
+def _get_chunks_meta(f: IO[bytes], form: _Form, start: int,
+                     end: int) -> dict[str, str | dict]:
+    meta: dict[str, str | dict] = dict()
+    for chunk_id, chunk_start, size in _iter_chunks(f, form, start, end):
+        if chunk_id in form.kept or chunk_id in _PADDING:
+            continue
+        f.seek(chunk_start)
+        if chunk_id == b'LIST':
+            if f.read(4) != b'INFO':
+                meta[_decode(chunk_id)] = '(Binary data %d bytes)' % size
+                continue
+            for tag, tag_start, tag_size in _iter_chunks(f, form, chunk_start + 4,
+                                                         chunk_start + size):
+                f.seek(tag_start)
+                value = _decode(f.read(tag_size))
+                meta[_INFO_TAGS.get(tag, _decode(tag).strip())] = value
+        elif chunk_id in (b'id3 ', b'ID3 '):
+            meta.update(_get_id3_meta(f.read(size)))
+        elif chunk_id == b'COMT' and form is _AIFF:
+            meta['Comment'] = _get_aiff_comments(f.read(size))
+        elif chunk_id in _AIFF_TAGS and form is _AIFF:
+            meta[_AIFF_TAGS[chunk_id]] = _decode(f.read(size))
+        else:
+            meta[_decode(chunk_id).strip()] = '(Binary data %d bytes)' % size
+    return meta
+
+
+def get_wav_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Return the metadata of the WAV file `f`, with the same names
+    as exiftool.
+
+    :raises ValueError: Raised if the file is invalid, or not supported.
+    """
+    _, start, end = next(_read_forms(f, _WAV))
+    return _get_chunks_meta(f, _WAV, start, end)
+
+
+def get_aiff_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Same as `get_wav_meta`, but for AIFF and AIFF-C files. """
+    _, start, end = next(_read_forms(f, _AIFF))
+    return _get_chunks_meta(f, _AIFF, start, end)
+
+
+def get_avi_meta(f: IO[bytes]) -> dict[str, str | dict]:
+    """ Same as `get_wav_meta`, but for AVI files. """
+    meta: dict[str, str | dict] = dict()
+    forms = list(_read_forms(f, _AVI))
+    if forms[0][0] != b'AVI ':
+        raise ValueError('Not an AVI file')
+    for _, start, end in forms:
+        for chunk_id, list_type, chunk_start, chunk_end in _iter_avi_chunks(f, start, end):
+            if list_type == b'INFO':
+                for tag, tag_start, tag_size in _iter_chunks(f, _AVI, chunk_start + 12,
+                                                             chunk_end):
+                    f.seek(tag_start)
+                    meta[_INFO_TAGS.get(tag, _decode(tag).strip())] = _decode(f.read(tag_size))
+            elif list_type in _AVI_BLANKED_LISTS:
+                meta[_decode(list_type)] = '(Binary data %d bytes)' % (chunk_end - chunk_start - 12)
+            elif chunk_id in _AVI_BLANKED and chunk_id not in _PADDING:
+                f.seek(chunk_start + 8)
+                meta[_INFO_TAGS[chunk_id]] = _decode(f.read(chunk_end - chunk_start - 8))
+    return meta
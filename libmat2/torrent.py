@@ -1,8 +1,14 @@
 from __future__ import annotations
 
+import concurrent.futures
+import functools
 import logging
+import mmap
+import os
+import shutil
+from typing import Any, Iterable, Iterator
 
-from . import abstract
+from . import abstract, fastcopy
 
 
 class TorrentParser(abstract.AbstractParser):
@@ -11,28 +17,82 @@ class TorrentParser(abstract.AbstractParser):
 
     def __init__(self, filename):
         super().__init__(filename)
+        # Only the positions of the top-level values are kept: the allowed
+        # ones are copied verbatim when cleaning, which is way faster than
+        # re-encoding them, and keeps the infohash intact.
         with open(self.filename, 'rb') as f:
-            self.dict_repr = _BencodeHandler().bdecode(f.read())
-        if self.dict_repr is None:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    self.__spans = _bencode_handler.bscan(m)
+            except ValueError:  # empty file
+                self.__spans = None
+        if self.__spans is None:
             raise ValueError
 
     def get_meta(self) -> dict[str, str | dict]:
         metadata = {}
-        for key, value in self.dict_repr.items():
-            if key not in self.allowlist:
-                metadata[key.decode('utf-8')] = value
+        with open(self.filename, 'rb') as f:
+            for key, (start, end) in self.__spans.items():
+                if key not in self.allowlist:
+                    f.seek(start)
+                    value = _bencode_handler.bdecode(f.read(end - start))
+                    metadata[key.decode('utf-8')] = value
         return metadata
 
     def remove_all(self) -> bool:
-        cleaned = dict()
-        for key, value in self.dict_repr.items():
-            if key in self.allowlist:
-                cleaned[key] = value
-        with open(self.output_filename, 'wb') as f:
-            f.write(_BencodeHandler().bencode(cleaned))
-        self.dict_repr = cleaned  # since we're stateful
+        cleaned = {k: v for k, v in self.__spans.items() if k in self.allowlist}
+        with open(self.filename, 'rb') as fin, open(self.output_filename, 'wb') as fout:
+            fout.write(b'd')
+            for key, (start, end) in sorted(cleaned.items()):
+                fout.write(_bencode_handler.bencode(key))
+                fout.flush()
+                fastcopy.copy_range(fin.fileno(), fout.fileno(), start, end - start)
+            fout.write(b'e')
+        self.__spans = cleaned  # since we're stateful
         return True
 
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        spans = _bencode_handler.bscan(data)
+        if spans is None:
+            raise ValueError
+        cleaned = [_bencode_handler.bencode(k) + data[start:end]
+                   for k, (start, end) in sorted(spans.items()) if k in cls.allowlist]
+        return b'd' + b''.join(cleaned) + b'e'
+
+
+def clean_torrents(filenames: Iterable[str], inplace: bool = False,
+                   skip_clean: bool = False,
+                   max_workers: int | None = None) -> Iterator[dict[str, Any]]:
+    """ Clean a batch of torrents, using threads since it's mostly bound
+    by I/O, and yield a report for each of them, in the same order.
+
+    Reports contain the `file`, and either the `removed` keys, along with
+    `skipped` if `skip_clean` is set and there wasn't anything to remove,
+    or the `error` that prevented the file from being cleaned.
+    """
+    clean = functools.partial(_clean_torrent, inplace=inplace, skip_clean=skip_clean)
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        yield from executor.map(clean, filenames)
+
+
+def _clean_torrent(filename: str, inplace: bool, skip_clean: bool) -> dict[str, Any]:
+    report: dict[str, Any] = {'file': filename}
+    try:
+        p = TorrentParser(filename)
+        report['removed'] = sorted(p.get_meta())
+        if skip_clean and not report['removed']:
+            report['skipped'] = True
+            return report
+        p.remove_all()
+        shutil.copymode(filename, p.output_filename)
+        if inplace:
+            os.rename(p.output_filename, filename)
+    except (OSError, ValueError) as e:
+        report.pop('removed', None)
+        report['error'] = str(e) or 'not a valid torrent'
+    return report
+
 
 class _BencodeHandler:
     """
@@ -49,6 +109,14 @@ class _BencodeHandler:
         for i in range(10):
             self.__decode_func[ord(str(i))] = self.__decode_string
 
+        self.__skip_func = {
+            ord('d'): self.__skip_dict,
+            ord('i'): self.__skip_int,
+            ord('l'): self.__skip_list,
+        }
+        for i in range(10):
+            self.__skip_func[ord(str(i))] = self.__skip_string
+
         self.__encode_func = {
             bytes: self.__encode_string,
             dict: self.__encode_dict,
@@ -57,73 +125,142 @@ class _BencodeHandler:
         }
 
     @staticmethod
-    def __decode_int(s: bytes) -> tuple[int, bytes]:
-        s = s[1:]
-        next_idx = s.index(b'e')
-        if s.startswith(b'-0'):
+    def __decode_int(s: bytes, idx: int) -> tuple[int, int]:
+        idx += 1  # skip leading `i`
+        next_idx = _find(s, b'e', idx)
+        if s[idx:idx+2] == b'-0':
             raise ValueError  # negative zero doesn't exist
-        elif s.startswith(b'0') and next_idx != 1:
+        elif s[idx] == ord('0') and next_idx != idx + 1:
             raise ValueError  # no leading zero except for zero itself
-        return int(s[:next_idx]), s[next_idx+1:]
+        return int(s[idx:next_idx]), next_idx + 1
 
     @staticmethod
-    def __decode_string(s: bytes) -> tuple[bytes, bytes]:
-        colon = s.index(b':')
-        # FIXME Python3 is broken here, the call to `ord` shouldn't be needed,
-        # but apparently it is. This is utterly idiotic.
-        if (s[0] == ord('0') or s[0] == '0') and colon != 1:
+    def __decode_string(s: bytes, idx: int) -> tuple[bytes, int]:
+        colon = _find(s, b':', idx)
+        if s[idx] == ord('0') and colon != idx + 1:
             raise ValueError
-        str_len = int(s[:colon])
-        s = s[1:]
-        return s[colon:colon+str_len], s[colon+str_len:]
+        str_len = int(s[idx:colon])
+        end = colon + 1 + str_len
+        if str_len < 0 or end > len(s):
+            raise ValueError
+        return s[colon+1:end], end
 
-    def __decode_list(self, s: bytes) -> tuple[list, bytes]:
+    def __decode_list(self, s: bytes, idx: int) -> tuple[list, int]:
         ret = list()
-        s = s[1:]  # skip leading `l`
-        while s[0] != ord('e'):
-            value, s = self.__decode_func[s[0]](s)
+        idx += 1  # skip leading `l`
+        while s[idx] != ord('e'):
+            value, idx = self.__decode_func[s[idx]](s, idx)
             ret.append(value)
-        return ret, s[1:]
+        return ret, idx + 1
 
-    def __decode_dict(self, s: bytes) -> tuple[dict, bytes]:
+    def __decode_dict(self, s: bytes, idx: int) -> tuple[dict, int]:
         ret = dict()
-        s = s[1:]  # skip leading `d`
-        while s[0] != ord(b'e'):
-            key, s = self.__decode_string(s)
-            ret[key], s = self.__decode_func[s[0]](s)
-        return ret, s[1:]
+        idx += 1  # skip leading `d`
+        while s[idx] != ord('e'):
+            key, idx = self.__decode_string(s, idx)
+            ret[key], idx = self.__decode_func[s[idx]](s, idx)
+        return ret, idx + 1
+
+    # The skipping functions are validating the values like the decoding ones,
+    # but are only returning the index following them.
+    def __skip_int(self, s: bytes, idx: int) -> int:
+        return self.__decode_int(s, idx)[1]
+
+    @staticmethod
+    def __skip_string(s: bytes, idx: int) -> int:
+        colon = _find(s, b':', idx)
+        if s[idx] == ord('0') and colon != idx + 1:
+            raise ValueError
+        end = colon + 1 + int(s[idx:colon])
+        if end <= colon or end > len(s):
+            raise ValueError
+        return end
+
+    def __skip_list(self, s: bytes, idx: int) -> int:
+        idx += 1  # skip leading `l`
+        while s[idx] != ord('e'):
+            idx = self.__skip_func[s[idx]](s, idx)
+        return idx + 1
+
+    def __skip_dict(self, s: bytes, idx: int) -> int:
+        idx += 1  # skip leading `d`
+        while s[idx] != ord('e'):
+            idx = self.__skip_string(s, idx)
+            idx = self.__skip_func[s[idx]](s, idx)
+        return idx + 1
 
     @staticmethod
-    def __encode_int(x: bytes) -> bytes:
-        return b'i' + bytes(str(x), 'utf-8') + b'e'
+    def __encode_int(x: int, out: list[bytes]) -> None:
+        out.append(b'i%de' % x)
 
     @staticmethod
-    def __encode_string(x: bytes) -> bytes:
-        return bytes((str(len(x))), 'utf-8') + b':' + x
+    def __encode_string(x: bytes, out: list[bytes]) -> None:
+        out.append(b'%d:' % len(x))
+        out.append(x)
 
-    def __encode_list(self, x: str) -> bytes:
-        ret = b''
+    def __encode_list(self, x: list, out: list[bytes]) -> None:
+        out.append(b'l')
         for i in x:
-            ret += self.__encode_func[type(i)](i)
-        return b'l' + ret + b'e'
+            self.__encode_func[type(i)](i, out)
+        out.append(b'e')
 
-    def __encode_dict(self, x: dict) -> bytes:
-        ret = b''
+    def __encode_dict(self, x: dict, out: list[bytes]) -> None:
+        out.append(b'd')
         for key, value in sorted(x.items()):
-            ret += self.__encode_func[type(key)](key)
-            ret += self.__encode_func[type(value)](value)
-        return b'd' + ret + b'e'
+            self.__encode_func[type(key)](key, out)
+            self.__encode_func[type(value)](value, out)
+        out.append(b'e')
 
     def bencode(self, s: dict | list | bytes | int) -> bytes:
-        return self.__encode_func[type(s)](s)
+        out: list[bytes] = list()
+        self.__encode_func[type(s)](s, out)
+        return b''.join(out)
 
     def bdecode(self, s: bytes) -> dict | None:
+        # The decoding functions are passing indexes around, instead of
+        # slices of the input, to avoid copying it over and over.
         try:
-            ret, trail = self.__decode_func[s[0]](s)
-        except (IndexError, KeyError, ValueError) as e:
+            ret, idx = self.__decode_func[s[0]](s, 0)
+        except (IndexError, KeyError, ValueError, RecursionError) as e:
             logging.warning("Not a valid bencoded string: %s", e)
             return None
-        if trail != b'':
+        if idx != len(s):
             logging.warning("Invalid bencoded value (data after valid prefix)")
             return None
         return ret
+
+    def bscan(self, s: bytes) -> dict[bytes, tuple[int, int]] | None:
+        """ Validate `s`, which must be a bencoded dictionary, and return
+        the start and the end of its values, without decoding them.
+        `s` can be anything that can be indexed and sliced like bytes,
+        like a memory-mapped file. """
+        spans = dict()
+        try:
+            if s[0] != ord('d'):
+                raise ValueError('not a dictionary')
+            idx = 1
+            while s[idx] != ord('e'):
+                key, idx = self.__decode_string(s, idx)
+                spans[key] = (idx, self.__skip_func[s[idx]](s, idx))
+                idx = spans[key][1]
+            idx += 1
+        except (IndexError, KeyError, ValueError, RecursionError) as e:
+            logging.warning("Not a valid bencoded string: %s", e)
+            return None
+        if idx != len(s):
+            logging.warning("Invalid bencoded value (data after valid prefix)")
+            return None
+        return spans
+
+
+# The handler is stateless, so there is no need to build its dispatch
+# tables for every file.
+_bencode_handler = _BencodeHandler()
+
+
+def _find(s: bytes, sub: bytes, start: int) -> int:
+    """ Like bytes.index, but also working on memory-mapped files. """
+    idx = s.find(sub, start)
+    if idx == -1:
+        raise ValueError('%r not found' % sub)
+    return idx
@@ -1,50 +1,140 @@
 from __future__ import annotations
 
+import io
+import json
+import os
+import re
+import select
 import subprocess
 import functools
 import shutil
 import logging
+import time
+from typing import Callable, ContextManager, IO
 
-from . import exiftool
+from . import asf, bmff, exiftool, riff
 
 class AbstractFFmpegParser(exiftool.ExiftoolParser):
     """ Abstract parser for all FFmpeg-based ones, mainly for video. """
     # Some fileformats have mandatory metadata fields
     meta_key_value_allowlist: dict[str, str | int] = dict()
 
-    def remove_all(self) -> bool:
+    def __init__(self, filename):
+        super().__init__(filename)
+        # Called with the key/value pairs of each of ffmpeg's progress reports
+        self.progress_callback: Callable[[dict[str, str]], None] | None = None
+        # Maximum duration of the remuxing, in seconds
+        self.timeout: float | None = None
+        # Run ffmpeg with the idle I/O scheduling class
+        self.idle_io = False
+
+    def _warn_about_mandatory_meta(self) -> None:
         if self.meta_key_value_allowlist:
             logging.warning('The format of "%s" (%s) has some mandatory '
                             'metadata fields; mat2 filled them with standard '
                             'data.', self.filename, ', '.join(self.mimetypes))
-        cmd = [_get_ffmpeg_path(),
-               '-i', self.filename,      # input file
-               '-y',                     # overwrite existing output file
-               '-map', '0',              # copy everything all streams from input to output
-               '-codec', 'copy',         # don't decode anything, just copy (speed!)
-               '-loglevel', 'panic',     # Don't show log
-               '-hide_banner',           # hide the banner
-               '-map_metadata', '-1',    # remove supperficial metadata
-               '-map_chapters', '-1',    # remove chapters
-               '-disposition', '0',      # Remove dispositions (check ffmpeg's manpage)
-               '-fflags', '+bitexact',   # don't add any metadata
-               '-flags:v', '+bitexact',  # don't add any metadata
-               '-flags:a', '+bitexact',  # don't add any metadata
-               self.output_filename]
+
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        """ Return the metadata of `f` without calling exiftool,
+        or None if the format isn't simple enough to allow it.
+
+        :raises ValueError: Raised if `f` can't be parsed natively
+        """
+        # pylint: disable=unused-argument
+        return None
+
+    def _remove_all_natively(self) -> bool:
+        """ Clean the file without remuxing it through ffmpeg, and return
+        False if the format isn't simple enough to allow it.
+
+        :raises ValueError: Raised if the file can't be cleaned natively
+        """
+        return False
+
+    def get_meta(self) -> dict[str, str | dict]:
+        try:
+            with open(self.filename, 'rb') as f:
+                meta = self._get_meta_natively(f)
+        except ValueError as e:
+            logging.info("Unable to parse %s natively: %s", self.filename, e)
+            meta = None
+        if meta is None:
+            meta = self.__get_meta_with_ffprobe()
+        if meta is None:
+            return super().get_meta()
+        return meta
+
+    def __get_meta_with_ffprobe(self) -> dict[str, str | dict] | None:
+        """ ffprobe only reads the headers of the containers,
+        while exiftool might go through the whole file. """
         try:
-            subprocess.run(cmd, check=True)
+            out = subprocess.run([_get_ffprobe_path(),
+                                  '-loglevel', 'quiet',
+                                  '-print_format', 'json',
+                                  '-show_format', '-show_streams',
+                                  self.filename],
+                                 check=True, stdout=subprocess.PIPE).stdout
+            probe = json.loads(out.decode('utf-8'))
+        except RuntimeError:  # pragma: no cover
+            return None
+        except (subprocess.CalledProcessError, ValueError) as e:
+            logging.info("Unable to probe %s with ffprobe: %s", self.filename, e)
+            return None
+        return self._filter_meta(_get_ffprobe_meta(probe))
+
+    @classmethod
+    def _get_meta_in_memory(cls, data: bytes) -> dict[str, str | dict] | None:
+        try:
+            meta = cls._get_meta_natively(io.BytesIO(data))
+        except ValueError:
+            meta = None
+        if meta is None:
+            return super()._get_meta_in_memory(data)
+        return meta
+
+    def remove_all(self) -> bool:
+        try:
+            if self._remove_all_natively():
+                self._warn_about_mandatory_meta()
+                return True
+        except ValueError as e:
+            logging.info("Unable to clean %s without ffmpeg: %s", self.filename, e)
+
+        self._warn_about_mandatory_meta()
+        args = ['-i', self.filename,      # input file
+                '-y',                     # overwrite existing output file
+                '-map', '0',              # copy everything all streams from input to output
+                '-codec', 'copy',         # don't decode anything, just copy (speed!)
+                '-loglevel', 'panic',     # Don't show log
+                '-hide_banner',           # hide the banner
+                '-map_metadata', '-1',    # remove supperficial metadata
+                '-map_chapters', '-1',    # remove chapters
+                '-disposition', '0',      # Remove dispositions (check ffmpeg's manpage)
+                '-fflags', '+bitexact',   # don't add any metadata
+                '-flags:v', '+bitexact',  # don't add any metadata
+                '-flags:a', '+bitexact',  # don't add any metadata
+                self.output_filename]
+        try:
+            _run_ffmpeg(args, self.progress_callback, self.timeout, self.idle_io)
         except subprocess.CalledProcessError as e:
             logging.error("Something went wrong during the processing of %s: return code %d", self.filename, e.returncode)
             return False
+        except subprocess.TimeoutExpired:
+            logging.error("The processing of %s took more than %g seconds", self.filename, self.timeout)
+            if os.path.exists(self.output_filename):
+                os.remove(self.output_filename)
+            return False
         return True
 
-    def get_meta(self) -> dict[str, str | dict]:
-        meta = super().get_meta()
+    @classmethod
+    def _filter_meta(cls, meta: dict[str, str | dict]) -> dict[str, str | dict]:
+        meta = super()._filter_meta(meta)
 
         ret: dict[str, str | dict] = dict()
         for key, value in meta.items():
-            if key in self.meta_key_value_allowlist:
-                if value == self.meta_key_value_allowlist[key]:
+            if key in cls.meta_key_value_allowlist:
+                if value == cls.meta_key_value_allowlist[key]:
                     continue
             ret[key] = value
         return ret
@@ -73,6 +163,14 @@ class WMVParser(AbstractFFmpegParser):
         'StreamType': 'Audio',
         }
 
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        return asf.get_meta(f)
+
+    def _remove_all_natively(self) -> bool:
+        asf.clean(self.filename, self.output_filename)
+        return True
+
 
 class AVIParser(AbstractFFmpegParser):
     mimetypes = {'video/x-msvideo', }
@@ -93,6 +191,14 @@ class AVIParser(AbstractFFmpegParser):
                       'SampleRate', 'AvgBytesPerSec', 'BitsPerSample',
                       'Duration', 'ImageSize', 'Megapixels'}
 
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        return riff.get_avi_meta(f)
+
+    def _remove_all_natively(self) -> bool:
+        riff.clean_avi(self.filename, self.output_filename)
+        return True
+
 
 class MP4Parser(AbstractFFmpegParser):
     mimetypes = {'video/mp4', }
@@ -127,6 +233,128 @@ class MP4Parser(AbstractFFmpegParser):
         'TrackVolume': '0.00%',
     }
 
+    @classmethod
+    def _get_meta_natively(cls, f: IO[bytes]) -> dict[str, str | dict] | None:
+        return cls._filter_meta(bmff.get_meta(f))
+
+    def _remove_all_natively(self) -> bool:
+        # Most files can be cleaned by only rewriting their `moov` box.
+        bmff.clean(self.filename, self.output_filename)
+        return True
+
+
+# Names of ffprobe's tags, as exiftool reports them, when they aren't
+# simply the CamelCase version of the former.
+_FFPROBE_NAMES = {
+    'creation_time': 'CreateDate',
+    'date': 'ContentCreateDate',
+    'handler_name': 'HandlerDescription',
+    'language': 'MediaLanguageCode',
+    'location': 'GPSCoordinates',
+    'vendor_id': 'HandlerVendorID',
+}
+
+# Values that are written by ffmpeg itself, and aren't metadata.
+_FFPROBE_DEFAULTS = {
+    'handler_name': {'VideoHandler', 'SoundHandler', 'DataHandler', 'SubtitleHandler'},
+    'language': {'und'},
+    'vendor_id': {'[0][0][0][0]'},
+}
+
+
+def _get_ffprobe_meta(probe: dict) -> dict[str, str | dict]:
+    """ Return the tags of the container and of its streams, from the json
+    output of `ffprobe -show_format -show_streams`, with exiftool's names. """
+    meta: dict[str, str | dict] = dict()
+    tags = [probe.get('format', {}).get('tags', {})]
+    tags += [stream.get('tags', {}) for stream in probe.get('streams', [])]
+    for key, value in (item for t in tags for item in t.items()):
+        if value in _FFPROBE_DEFAULTS.get(key, ()):
+            continue
+        name = _FFPROBE_NAMES.get(key)
+        if name is None:
+            # `WM/EncodingSettings`, `major_brand`, `com.apple.quicktime.make`, …
+            key = key.split('/')[-1]
+            name = ''.join(part[:1].upper() + part[1:] for part in re.split('[^0-9A-Za-z]+', key))
+        meta.setdefault(name, str(value))
+    return meta
+
+
+# Limits the number of ffmpeg processes running at the same time,
+# see `set_ffmpeg_semaphore`.
+_ffmpeg_semaphore: ContextManager | None = None
+
+
+def set_ffmpeg_semaphore(semaphore: ContextManager | None) -> None:
+    """ Make every ffmpeg run acquire `semaphore` first. Since it can be a
+    `multiprocessing` one, this can be used as the initializer of a pool
+    of processes, to limit the number of ffmpeg processes across all its
+    workers. """
+    global _ffmpeg_semaphore  # pylint: disable=global-statement
+    _ffmpeg_semaphore = semaphore
+
+
+def _run_ffmpeg(args: list[str],
+                progress_callback: Callable[[dict[str, str]], None] | None = None,
+                timeout: float | None = None, idle_io: bool = False) -> None:
+    """ Run ffmpeg with `args`, reporting its progress to `progress_callback`.
+
+    :raises subprocess.CalledProcessError: Raised if ffmpeg failed
+    :raises subprocess.TimeoutExpired: Raised if ffmpeg took more than
+                                       `timeout` seconds, and was killed
+    """
+    cmd = [_get_ffmpeg_path(),
+           '-progress', 'pipe:1',  # machine-readable progress on stdout
+           '-nostats'] + args
+    if idle_io:
+        ionice = shutil.which('ionice')
+        if ionice:
+            cmd = [ionice, '-c', '3'] + cmd
+        else:  # pragma: no cover
+            logging.warning("Unable to find ionice, running ffmpeg with the default I/O priority")
+    if _ffmpeg_semaphore is None:
+        _run_with_progress(cmd, progress_callback, timeout)
+        return
+    with _ffmpeg_semaphore:
+        _run_with_progress(cmd, progress_callback, timeout)
+
+
+def _run_with_progress(cmd: list[str],
+                       progress_callback: Callable[[dict[str, str]], None] | None,
+                       timeout: float | None) -> None:
+    """ Run `cmd`, which reports its progress on stdout like ffmpeg's
+    `-progress` option does: blocks of key=value lines, each one ending
+    with a `progress` key. """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        assert proc.stdout is not None  # please mypy
+        fd = proc.stdout.fileno()
+        pending = b''
+        report: dict[str, str] = dict()
+        try:
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                        raise subprocess.TimeoutExpired(cmd, timeout)  # type: ignore
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break
+                *lines, pending = (pending + chunk).split(b'\n')
+                for line in lines:
+                    key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+                    report[key] = value
+                    if key == 'progress':
+                        if progress_callback is not None:
+                            progress_callback(report)
+                        report = dict()
+            proc.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
 
 @functools.lru_cache(maxsize=None)
 def _get_ffmpeg_path() -> str:  # pragma: no cover
@@ -135,3 +363,12 @@ def _get_ffmpeg_path() -> str:  # pragma: no cover
         return which_path
 
     raise RuntimeError("Unable to find ffmpeg")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ffprobe_path() -> str:  # pragma: no cover
+    which_path = shutil.which('ffprobe')
+    if which_path:
+        return which_path
+
+    raise RuntimeError("Unable to find ffprobe")
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 from html import parser, escape
-from typing import Any
+from typing import IO, Any
+import io
+import os
 import re
 import string
 
 from . import abstract
 
+# Number of characters read at once from HTML and CSS files
+_CHUNK_SIZE = 1024 * 1024
 
 # pylint: disable=too-many-instance-attributes
 
@@ -14,35 +18,208 @@ class CSSParser(abstract.AbstractParser):
     """There is no such things as metadata in CSS files,
     only comments of the form `/* … */`, so we're removing the laters."""
     mimetypes = frozenset({'text/css', })
-    flags = re.MULTILINE | re.DOTALL
 
-    def remove_all(self) -> bool:
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.__meta: dict[str, Any] | None = None
+
+    def __parse(self, output: IO[str] | None) -> dict[str, Any]:
+        """ Scan the file chunk by chunk, writing it without its comments
+        to `output` as it goes, and return its metadata. """
+        scanner = _CSSScanner(output)
         with open(self.filename, encoding='utf-8') as f:
             try:
-                content = f.read()
-            except UnicodeDecodeError as e:  # pragma: no cover
+                while True:
+                    chunk = f.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    scanner.feed(chunk)
+            except UnicodeDecodeError as e:
                 raise ValueError(e)
-            cleaned = re.sub(r'/\*.*?\*/', '', content, count=0, flags=self.flags)
-        with open(self.output_filename, 'w', encoding='utf-8') as f:
-            f.write(cleaned)
+        scanner.close()
+        return scanner.meta
+
+    def remove_all(self) -> bool:
+        try:
+            with open(self.output_filename, 'w', encoding='utf-8') as f:
+                self.__meta = self.__parse(f)
+        except ValueError:
+            os.remove(self.output_filename)
+            raise
         return True
 
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        try:
+            content = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise ValueError(e)
+        output = io.StringIO()
+        scanner = _CSSScanner(output)
+        scanner.feed(content)
+        scanner.close()
+        return output.getvalue().encode('utf-8')
+
     def get_meta(self) -> dict[str, Any]:
-        metadata = {}
-        with open(self.filename, encoding='utf-8') as f:
+        if self.__meta is None:
+            self.__meta = self.__parse(None)
+        return self.__meta
+
+
+class _CSSScanner:
+    """ Remove the comments of a stylesheet fed chunk by chunk, and collect
+    their content as metadata. Strings and unquoted `url()` are kept as-is,
+    since they might legitimately contain `/*`.
+
+    Everything that can't be decided yet, like a trailing `/` that might be
+    starting a comment, is kept until the next call to `feed`.
+    """
+    __code_tokens = re.compile(r'/\*|["\'\\]|url\(', re.IGNORECASE)
+    __url_start = re.compile(r'\s*')
+    __url_end = re.compile(r'[)\\]|\s+')
+    __ends = {
+        '"': re.compile(r'["\\\n]'),  # an unescaped newline ends a string
+        "'": re.compile(r"['\\\n]"),
+    }
+
+    def __init__(self, output: IO[str] | None = None):
+        self.meta: dict[str, Any] = dict()
+        self.__output = output
+        self.__pending = ''
+        # Either 'code', 'comment', 'url-start', 'url', or a quote
+        self.__state = 'code'
+        self.__comment: list[str] = list()
+
+    def feed(self, data: str):
+        self.__scan(self.__pending + data, final=False)
+
+    def close(self):
+        self.__scan(self.__pending, final=True)
+        if self.__state == 'comment':  # comments end with the file
+            self.__end_comment()
+
+    def __scan(self, buf: str, final: bool):
+        pos = 0
+        while pos < len(buf):
+            state = self.__state
+            if state == 'code':
+                new_pos = self.__scan_code(buf, pos, final)
+            elif state == 'comment':
+                new_pos = self.__scan_comment(buf, pos, final)
+            elif state == 'url-start':
+                new_pos = self.__scan_url_start(buf, pos)
+            elif state == 'url':
+                new_pos = self.__scan_url(buf, pos, final)
+            else:
+                new_pos = self.__scan_until_end(buf, pos, final)
+            if new_pos == pos and state == self.__state:
+                break  # more data is needed
+            pos = new_pos
+        self.__pending = buf[pos:]
+
+    def __write(self, data: str):
+        if self.__output is not None and data:
+            self.__output.write(data)
+
+    def __scan_code(self, buf: str, pos: int, final: bool) -> int:
+        match = self.__code_tokens.search(buf, pos)
+        if match is None:
+            end = len(buf)
+            if not final:  # keep what might be the beginning of a token
+                for prefix in ('url', 'ur', 'u', '/'):
+                    if buf[-len(prefix):].lower() == prefix:
+                        end -= len(prefix)
+                        break
+            self.__write(buf[pos:max(pos, end)])
+            return max(pos, end)
+
+        self.__write(buf[pos:match.start()])
+        token = match.group()
+        if token == '/*':
+            self.__state = 'comment'
+        elif token == '\\':
+            return self.__scan_escape(buf, match.start(), final)
+        elif token in ('"', "'"):
+            self.__write(token)
+            self.__state = token
+        else:
+            self.__write(token)
+            self.__state = 'url-start'
+        return match.end()
+
+    def __scan_escape(self, buf: str, pos: int, final: bool) -> int:
+        if pos + 1 == len(buf) and not final:
+            return pos  # the escaped character is in the next chunk
+        self.__write(buf[pos:pos + 2])
+        return min(pos + 2, len(buf))
+
+    def __scan_comment(self, buf: str, pos: int, final: bool) -> int:
+        end = buf.find('*/', pos)
+        if end == -1:
+            end = len(buf)
+            if not final and buf.endswith('*'):
+                end -= 1
+            self.__comment.append(buf[pos:end])
+            return end
+        self.__comment.append(buf[pos:end])
+        self.__end_comment()
+        self.__state = 'code'
+        return end + 2
+
+    def __end_comment(self):
+        for line in ''.join(self.__comment).splitlines():
             try:
-                content = f.read()
-            except UnicodeDecodeError as e:  # pragma: no cover
-                raise ValueError(e)
-        cssdoc = re.findall(r'/\*(.*?)\*/', content, self.flags)
-        for match in cssdoc:
-            for line in match.splitlines():
-                try:
-                    k, v = line.split(':')
-                    metadata[k.strip(string.whitespace + '*')] = v.strip()
-                except ValueError:
-                    metadata['harmful data'] = line.strip()
-        return metadata
+                k, v = line.split(':')
+                self.meta[k.strip(string.whitespace + '*')] = v.strip()
+            except ValueError:
+                self.meta['harmful data'] = line.strip()
+        self.__comment.clear()
+
+    def __scan_url_start(self, buf: str, pos: int) -> int:
+        match = self.__url_start.match(buf, pos)
+        self.__write(match.group())  # type: ignore
+        pos = match.end()  # type: ignore
+        if pos < len(buf):
+            # Quoted urls are regular strings
+            self.__state = 'code' if buf[pos] in ('"', "'") else 'url'
+        return pos
+
+    def __scan_url(self, buf: str, pos: int, final: bool) -> int:
+        """ Scan an unquoted url until its end. Like browsers recovering from
+        a bad url, it's also left at a newline, or at whitespace that isn't
+        followed by `)`, so that an unterminated `url(` doesn't prevent the
+        following comments from being removed. """
+        match = self.__url_end.search(buf, pos)
+        if match is None:
+            self.__write(buf[pos:])
+            return len(buf)
+        self.__write(buf[pos:match.start()])
+        token = match.group()
+        if token == '\\':
+            return self.__scan_escape(buf, match.start(), final)
+        # whitespace on a single line can still be followed by the `)`
+        trailing_whitespace = token != ')' and '\n' not in token
+        if trailing_whitespace and match.end() == len(buf) and not final:
+            return match.start()  # the `)` might be in the next chunk
+        self.__write(token)
+        self.__state = 'code'
+        if trailing_whitespace and buf.startswith(')', match.end()):
+            self.__write(')')
+            return match.end() + 1
+        return match.end()
+
+    def __scan_until_end(self, buf: str, pos: int, final: bool) -> int:
+        """ Scan a string until its end. """
+        match = self.__ends[self.__state].search(buf, pos)
+        if match is None:
+            self.__write(buf[pos:])
+            return len(buf)
+        self.__write(buf[pos:match.start()])
+        if match.group() == '\\':
+            return self.__scan_escape(buf, match.start(), final)
+        self.__write(match.group())
+        self.__state = 'code'
+        return match.end()
 
 
 class AbstractHTMLParser(abstract.AbstractParser):
@@ -53,17 +230,53 @@ class AbstractHTMLParser(abstract.AbstractParser):
 
     def __init__(self, filename):
         super().__init__(filename)
-        self.__parser = _HTMLParser(self.filename, self.tags_blocklist,
-                                    self.tags_required_blocklist)
-        with open(filename, encoding='utf-8') as f:
-            self.__parser.feed(f.read())
-        self.__parser.close()
+        # The file is only parsed when needed, since it might be huge.
+        self.__meta: dict[str, Any] | None = None
+
+    def __parse(self, output: IO[str] | None) -> dict[str, Any]:
+        """ Feed the file to the parser chunk by chunk, writing the
+        cleaned content to `output` as it goes, and return its metadata.
+
+        :raises ValueError: Raised if the file isn't valid (enough).
+        """
+        html_parser = _HTMLParser(self.filename, self.tags_blocklist,
+                                  self.tags_required_blocklist, output)
+        with open(self.filename, encoding='utf-8') as f:
+            while True:
+                chunk = f.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                html_parser.feed(chunk)
+        html_parser.close()
+        return html_parser.get_meta()
 
     def get_meta(self) -> dict[str, Any]:
-        return self.__parser.get_meta()
+        if self.__meta is None:
+            self.__meta = self.__parse(None)
+        return self.__meta
 
     def remove_all(self) -> bool:
-        return self.__parser.remove_all(self.output_filename)
+        try:
+            with open(self.output_filename, 'w', encoding='utf-8') as f:
+                self.__meta = self.__parse(f)
+        except ValueError:
+            os.remove(self.output_filename)
+            raise
+        return True
+
+    @classmethod
+    def _remove_all_in_memory(cls, data: bytes, lightweight: bool) -> bytes | None:
+        try:
+            content = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise ValueError(e)
+        output = io.StringIO()
+        html_parser = _HTMLParser('<memory>', cls.tags_blocklist,
+                                  cls.tags_required_blocklist, output)
+        html_parser.feed(content)
+        html_parser.close()
+        html_parser.get_meta()  # check that every tag was closed
+        return output.getvalue().encode('utf-8')
 
 
 class HTMLParser(AbstractHTMLParser):
@@ -83,27 +296,43 @@ class _HTMLParser(parser.HTMLParser):
     and hoping for the best.
 
     Moreover, the parser.HTMLParser call doesn't provide a get_endtag_text
-    method, so we have to use get_starttag_text instead, put its result in a
-    LIFO, and transform it in a closing tag when needed.
+    method, so we have to use get_starttag_text instead, put the name it
+    contains in a LIFO, and transform it in a closing tag when needed.
+
+    The output is accumulated as a list of chunks, to avoid quadratic
+    string concatenations on large documents, written to `output` (or
+    discarded if there is none) after each call to `feed`.
 
     Also, gotcha: the `tag` parameters are always in lowercase.
     """
-    def __init__(self, filename, blocklisted_tags, required_blocklisted_tags):
+    def __init__(self, filename, blocklisted_tags, required_blocklisted_tags,
+                 output: IO[str] | None = None):
         super().__init__()
         self.filename = filename
-        self.__textrepr = ''
+        self.__output = output
+        self.__textrepr: list[str] = list()
         self.__meta = {}
-        self.__validation_queue: list[str] = list()
+        # Tuples of the original name of the opened tags, with their case
+        # preserved, along with their text for the error messages.
+        self.__validation_queue: list[tuple[str, str]] = list()
 
         # We're using counters instead of booleans, to handle nested tags
         self.__in_dangerous_but_required_tag = 0
         self.__in_dangerous_tag = 0
 
+        # The text between two tags can be split across several calls to
+        # `handle_data`, depending on the chunks given to `feed`, so its
+        # whitespace-only pieces are held back until it's known whether
+        # the whole text is kept.
+        self.__pending_whitespace: list[str] = list()
+        self.__keep_text = False
+
         if required_blocklisted_tags & blocklisted_tags:  # pragma: nocover
             raise ValueError("There is an overlap between %s and %s" % (
                 required_blocklisted_tags, blocklisted_tags))
         self.tag_required_blocklist = required_blocklisted_tags
         self.tag_blocklist = blocklisted_tags
+        self.__all_blocklisted_tags = required_blocklisted_tags | blocklisted_tags
 
     def error(self, message):  # pragma: no cover
         """ Amusingly, Python's documentation doesn't mention that this
@@ -114,30 +343,49 @@ class _HTMLParser(parser.HTMLParser):
         """
         raise ValueError(message)
 
+    def feed(self, data: str):
+        super().feed(data)
+        self.__flush()
+
+    def close(self):
+        super().close()
+        self.__end_text()
+        self.__flush()
+
+    def __end_text(self):
+        self.__pending_whitespace.clear()
+        self.__keep_text = False
+
+    def __flush(self):
+        if self.__output is not None:
+            self.__output.writelines(self.__textrepr)
+        self.__textrepr.clear()
+
     def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
+        self.__end_text()
         # Ignore the type, because mypy is too stupid to infer
         # that get_starttag_text() can't return None.
-        original_tag = self.get_starttag_text()  # type: ignore
-        self.__validation_queue.append(original_tag)  # type: ignore
+        original_tag: str = self.get_starttag_text()  # type: ignore
+        name = original_tag[1:-1].split(' ')[0]  # remove <, > and attributes
+        self.__validation_queue.append((name, original_tag))
 
         if tag in self.tag_blocklist:
             self.__in_dangerous_tag += 1
 
         if self.__in_dangerous_tag == 0:
             if self.__in_dangerous_but_required_tag == 0:
-                self.__textrepr += original_tag
+                self.__textrepr.append(original_tag)
 
         if tag in self.tag_required_blocklist:
             self.__in_dangerous_but_required_tag += 1
 
     def handle_endtag(self, tag: str):
+        self.__end_text()
         if not self.__validation_queue:
             raise ValueError("The closing tag %s doesn't have a corresponding "
                              "opening one in %s." % (tag, self.filename))
 
-        previous_tag = self.__validation_queue.pop()
-        previous_tag = previous_tag[1:-1]  # remove < and >
-        previous_tag = previous_tag.split(' ')[0]  # remove attributes
+        previous_tag, _ = self.__validation_queue.pop()
         if tag != previous_tag.lower():
             raise ValueError("The closing tag %s doesn't match the previous "
                              "tag %s in %s" %
@@ -149,7 +397,7 @@ class _HTMLParser(parser.HTMLParser):
         if self.__in_dangerous_tag == 0:
             if self.__in_dangerous_but_required_tag == 0:
                 # There is no `get_endtag_text()` method :/
-                self.__textrepr += '</' + previous_tag + '>'
+                self.__textrepr.append('</' + previous_tag + '>')
 
         if tag in self.tag_blocklist:
             self.__in_dangerous_tag -= 1
@@ -157,12 +405,18 @@ class _HTMLParser(parser.HTMLParser):
     def handle_data(self, data: str):
         if self.__in_dangerous_but_required_tag == 0:
             if self.__in_dangerous_tag == 0:
-                if data.strip():
-                    self.__textrepr += escape(data)
+                if self.__keep_text or data.strip():
+                    self.__textrepr.extend(self.__pending_whitespace)
+                    self.__pending_whitespace.clear()
+                    self.__textrepr.append(escape(data))
+                    self.__keep_text = True
+                else:
+                    self.__pending_whitespace.append(data)
 
     def handle_startendtag(self, tag: str,
                            attrs: list[tuple[str, str | None]]):
-        if tag in self.tag_required_blocklist | self.tag_blocklist:
+        self.__end_text()
+        if tag in self.__all_blocklisted_tags:
             meta = {k:v for k, v in attrs}
             name = meta.get('name', 'harmful metadata')
             content = meta.get('content', 'harmful data')
@@ -170,25 +424,16 @@ class _HTMLParser(parser.HTMLParser):
 
             if self.__in_dangerous_tag == 0:
                 if tag in self.tag_required_blocklist:
-                    self.__textrepr += '<' + tag + ' />'
+                    self.__textrepr.append('<' + tag + ' />')
                 return
 
         if self.__in_dangerous_tag == 0:
             if self.__in_dangerous_but_required_tag == 0:
-                self.__textrepr += self.get_starttag_text()
-
-    def remove_all(self, output_filename: str) -> bool:
-        if self.__validation_queue:
-            raise ValueError("Some tags (%s) were left unclosed in %s" % (
-                ', '.join(self.__validation_queue),
-                self.filename))
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(self.__textrepr)
-        return True
+                self.__textrepr.append(self.get_starttag_text())  # type: ignore
 
     def get_meta(self) -> dict[str, Any]:
         if self.__validation_queue:
             raise ValueError("Some tags (%s) were left unclosed in %s" % (
-                ', '.join(self.__validation_queue),
+                ', '.join(text for _, text in self.__validation_queue),
                 self.filename))
         return self.__meta
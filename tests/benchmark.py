@@ -0,0 +1,82 @@
+"""
+Rough benchmarks of mat2's pure-python parsers, on synthetic files.
+
+Usage: python3 ./tests/benchmark.py
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from libmat2 import torrent, web
+
+
+def _make_torrent(nb_files: int, nb_pieces: int) -> bytes:
+    files = [{b'length': i * 1000, b'path': [b'dir%d' % (i % 50), b'file%d.bin' % i]}
+             for i in range(nb_files)]
+    return torrent._BencodeHandler().bencode({
+        b'announce': b'http://example.com/announce',
+        b'created by': b'mktorrent 1.0',
+        b'creation date': 1522397702,
+        b'info': {
+            b'name': b'benchmark',
+            b'piece length': 262144,
+            b'pieces': os.urandom(20 * nb_pieces),
+            b'files': files,
+        },
+    })
+
+
+def _bench(name: str, stmt, number: int = 5) -> None:
+    duration = min(timeit.repeat(stmt, number=number, repeat=3)) / number
+    print('%-40s %8.2f ms' % (name, duration * 1000))
+
+
+def bench_torrent() -> None:
+    handler = torrent._BencodeHandler()
+    for nb_files, nb_pieces in ((100, 1000), (20000, 100000), (100000, 500000)):
+        data = _make_torrent(nb_files, nb_pieces)
+        decoded = handler.bdecode(data)
+        size = '%dkB' % (len(data) // 1024)
+        _bench('bdecode (%s)' % size, lambda data=data: handler.bdecode(data))
+        _bench('bencode (%s)' % size, lambda decoded=decoded: handler.bencode(decoded))
+        _bench('bscan (%s)' % size, lambda data=data: handler.bscan(data))
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'bench.torrent')
+            with open(path, 'wb') as f:
+                f.write(data)
+            _bench('TorrentParser.remove_all (%s)' % size,
+                   lambda path=path: torrent.TorrentParser(path).remove_all())
+
+
+def _make_html(nb_paragraphs: int) -> str:
+    head = '<html><head><title>benchmark</title><meta name="author" content="jvoisin"/></head>'
+    paragraph = '<p class="x">Some <b>bold</b> &amp; <i>italic</i> text<br/></p>\n'
+    return head + '<body>' + paragraph * nb_paragraphs + '</body></html>'
+
+
+def bench_html() -> None:
+    for nb_paragraphs in (1000, 100000):
+        data = _make_html(nb_paragraphs).encode('utf-8')
+        size = '%dkB' % (len(data) // 1024)
+        _bench('HTMLParser in memory (%s)' % size,
+               lambda data=data: web.HTMLParser._remove_all_in_memory(data, False),
+               number=1)
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'bench.html')
+            with open(path, 'wb') as f:
+                f.write(data)
+            _bench('HTMLParser.remove_all (%s)' % size,
+                   lambda path=path: web.HTMLParser(path).remove_all(), number=1)
+
+
+if __name__ == '__main__':
+    print('[+] Torrent')
+    bench_torrent()
+    print('[+] HTML')
+    bench_html()
@@ -1,8 +1,10 @@
+import json
 import random
 import os
 import shutil
 import stat
 import subprocess
+import tempfile
 import unittest
 import glob
 
@@ -304,6 +306,21 @@ class TestInplaceCleaning(unittest.TestCase):
         self.assertIn(b'  No metadata found in ./tests/data/clean.jpg.\n', stdout)
         os.remove('./tests/data/clean.jpg')
 
+    def test_cleaning_audio(self):
+        shutil.copy('./tests/data/dirty.flac', './tests/data/clean.flac')
+        os.chmod('./tests/data/clean.flac', 0o600)
+        proc = subprocess.Popen(mat2_binary + ['--inplace', './tests/data/clean.flac'],
+                stdout=subprocess.PIPE)
+        proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(os.stat('./tests/data/clean.flac').st_mode & 0o777, 0o600)
+        self.assertFalse(os.path.exists('./tests/data/clean.cleaned.flac'))
+        proc = subprocess.Popen(mat2_binary + ['--show', './tests/data/clean.flac'],
+                stdout=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        self.assertIn(b'  No metadata found in ./tests/data/clean.flac.\n', stdout)
+        os.remove('./tests/data/clean.flac')
+
     def test_cleaning_multiple_one_fails(self):
         files = ['./tests/data/clean_%d.jpg' % i for i in range(9)]
         for f in files:
@@ -322,3 +339,90 @@ class TestInplaceCleaning(unittest.TestCase):
         for i in range(10):
             os.remove('./tests/data/clean_%d.jpg' % i)
 
+
+
+class TestCache(unittest.TestCase):
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        shutil.copy('./tests/data/dirty.jpg', './tests/data/clean.jpg')
+
+        for _ in range(2):
+            proc = subprocess.Popen(mat2_binary + ['--cache-dir', cache_dir, '--show',
+                                                   './tests/data/clean.jpg'],
+                    stdout=subprocess.PIPE)
+            stdout, _ = proc.communicate()
+            self.assertIn(b'Comment: Created with GIMP', stdout)
+
+            proc = subprocess.Popen(mat2_binary + ['--cache-dir', cache_dir,
+                                                   './tests/data/clean.jpg'],
+                    stdout=subprocess.PIPE)
+            proc.communicate()
+            self.assertEqual(proc.returncode, 0)
+
+            p = images.JPGParser('./tests/data/clean.cleaned.jpg')
+            self.assertEqual(p.get_meta(), {})
+            os.remove('./tests/data/clean.cleaned.jpg')
+
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        os.remove('./tests/data/clean.jpg')
+        shutil.rmtree(cache_dir)
+
+
+class TestSkipClean(unittest.TestCase):
+    def test_skip_clean(self):
+        shutil.copy('./tests/data/dirty.txt', './tests/data/clean.txt')
+        shutil.copy('./tests/data/dirty.torrent', './tests/data/clean.torrent')
+        proc = subprocess.Popen(mat2_binary + ['--skip-clean', './tests/data/clean.txt',
+                                               './tests/data/clean.torrent'],
+                stdout=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertIn(b'1 file(s) without metadata were skipped.', stdout)
+        self.assertTrue(os.path.samefile('./tests/data/clean.txt',
+                                         './tests/data/clean.cleaned.txt'))
+        self.assertFalse(os.path.samefile('./tests/data/clean.torrent',
+                                          './tests/data/clean.cleaned.torrent'))
+
+        # An already-existing output is replaced
+        proc = subprocess.Popen(mat2_binary + ['--skip-clean', './tests/data/clean.cleaned.torrent'],
+                stdout=subprocess.PIPE)
+        stdout, _ = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        self.assertIn(b'1 file(s) without metadata were skipped.', stdout)
+
+        for f in ('clean.txt', 'clean.cleaned.txt', 'clean.torrent',
+                  'clean.cleaned.torrent', 'clean.cleaned.cleaned.torrent'):
+            os.remove('./tests/data/' + f)
+
+
+class TestTorrentReport(unittest.TestCase):
+    def test_torrent_report(self):
+        shutil.copy('./tests/data/dirty.torrent', './tests/data/clean.torrent')
+        with tempfile.TemporaryDirectory() as d:
+            report = os.path.join(d, 'report.ndjson')
+            proc = subprocess.Popen(mat2_binary + ['--torrent-report', report,
+                                                   './tests/data/clean.torrent'],
+                    stdout=subprocess.PIPE)
+            proc.communicate()
+            self.assertEqual(proc.returncode, 0)
+            with open(report) as f:
+                entries = [json.loads(line) for line in f]
+            self.assertEqual(entries, [{'file': './tests/data/clean.torrent',
+                                        'removed': ['created by', 'creation date']}])
+
+            # Torrents failing to be cleaned are reported as well
+            shutil.copy('./tests/data/dirty.jpg', './tests/data/clean.torrent')
+            proc = subprocess.Popen(mat2_binary + ['--torrent-report', report,
+                                                   './tests/data/clean.torrent'],
+                    stdout=subprocess.PIPE)
+            stdout, _ = proc.communicate()
+            self.assertEqual(proc.returncode, 255)
+            self.assertIn(b'something went wrong when cleaning ./tests/data/clean.torrent', stdout)
+            with open(report) as f:
+                entries = [json.loads(line) for line in f]
+            self.assertEqual(len(entries), 1)
+            self.assertIn('error', entries[0])
+
+        for f in ('clean.torrent', 'clean.cleaned.torrent'):
+            os.remove('./tests/data/' + f)
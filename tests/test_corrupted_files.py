@@ -156,6 +156,11 @@ class TestCorruptedFiles(unittest.TestCase):
         with self.assertRaises(ValueError):
             torrent.TorrentParser('./tests/data/clean.torrent')
 
+        with open("./tests/data/clean.torrent", "w") as f:
+            f.write("d8:announce5:aaae")
+        with self.assertRaises(ValueError):
+            torrent.TorrentParser('./tests/data/clean.torrent')
+
         os.remove('./tests/data/clean.torrent')
 
     def test_odg(self):
@@ -195,6 +200,21 @@ class TestCorruptedFiles(unittest.TestCase):
              images.JPGParser('./tests/data/clean.jpg')
         os.remove('./tests/data/clean.jpg')
 
+    def test_ppm(self):
+        shutil.copy('./tests/data/dirty.png', './tests/data/clean.ppm')
+        p = images.PPMParser('./tests/data/clean.ppm')
+        with self.assertRaises(ValueError):
+            p.get_meta()
+        with self.assertRaises(ValueError):
+            p.remove_all()
+
+        with open('./tests/data/clean.ppm', 'wb') as f:
+            f.write(b'P6\n# truncated\n1 1')
+        p = images.PPMParser('./tests/data/clean.ppm')
+        with self.assertRaises(ValueError):
+            p.remove_all()
+        os.remove('./tests/data/clean.ppm')
+
     def test_png_lightweight(self):
         shutil.copy('./tests/data/dirty.torrent', './tests/data/clean.png')
         with self.assertRaises(ValueError):
@@ -241,8 +261,12 @@ class TestCorruptedFiles(unittest.TestCase):
         shutil.copy('./tests/data/dirty.html', './tests/data/clean.html')
         with open('./tests/data/clean.html', 'a') as f:
             f.write('<open>but not</closed>')
+        p = web.HTMLParser('./tests/data/clean.html')
         with self.assertRaises(ValueError):
-            web.HTMLParser('./tests/data/clean.html')
+            p.get_meta()
+        with self.assertRaises(ValueError):
+            p.remove_all()
+        self.assertFalse(os.path.exists('./tests/data/clean.cleaned.html'))
         os.remove('./tests/data/clean.html')
 
         # Yes, we're able to deal with malformed html :/
@@ -258,8 +282,9 @@ class TestCorruptedFiles(unittest.TestCase):
 
         with open('./tests/data/clean.html', 'w') as f:
             f.write('</meta>')
+        p = web.HTMLParser('./tests/data/clean.html')
         with self.assertRaises(ValueError):
-            web.HTMLParser('./tests/data/clean.html')
+            p.get_meta()
         os.remove('./tests/data/clean.html')
 
         with open('./tests/data/clean.html', 'w') as f: